@@ -0,0 +1,112 @@
+"""
+256 bit word arithmetic of the EVM.
+
+All functions take and return unsigned words in ``[0, 2**256)`` and
+implement the semantics of the opcode they are named after, with the
+operands in stack order. The common case of small operands avoids
+masking the result, which keeps the values python ints (instead of
+longs on python 2) and skips the big number `&`.
+"""
+TT256 = 2 ** 256
+TT256M1 = 2 ** 256 - 1
+TT255 = 2 ** 255
+TT128 = 2 ** 128
+
+# per byte index of SIGNEXTEND: the sign bit, the bits above and below it
+SIGN_BITS = [1 << (b * 8 + 7) for b in range(32)]
+EXTEND_HIGH = [TT256 - s for s in SIGN_BITS]
+EXTEND_LOW = [s - 1 for s in SIGN_BITS]
+
+# exponent of the powers of two below 2**256
+POW2_EXP = dict((1 << i, i) for i in range(256))
+
+
+def to_signed(x):
+    return x if x < TT255 else x - TT256
+
+
+def add(a, b):
+    r = a + b
+    return r if r < TT256 else r - TT256
+
+
+def sub(a, b):
+    r = a - b
+    return r if r >= 0 else r + TT256
+
+
+def mul(a, b):
+    if a < TT128 and b < TT128:
+        return a * b
+    return (a * b) & TT256M1
+
+
+def div(a, b):
+    return a // b if b else 0
+
+
+def mod(a, b):
+    return a % b if b else 0
+
+
+def sdiv(a, b):
+    if not b:
+        return 0
+    if a < TT255 and b < TT255:
+        return a // b
+    neg = False
+    if a >= TT255:
+        a, neg = TT256 - a, True
+    if b >= TT255:
+        b, neg = TT256 - b, not neg
+    q = a // b
+    return (TT256 - q) & TT256M1 if neg else q
+
+
+def smod(a, b):
+    if not b:
+        return 0
+    if a < TT255 and b < TT255:
+        return a % b
+    if b >= TT255:
+        b = TT256 - b
+    if a >= TT255:
+        return (TT256 - (TT256 - a) % b) & TT256M1
+    return a % b
+
+
+def addmod(a, b, m):
+    return (a + b) % m if m else 0
+
+
+def mulmod(a, b, m):
+    return (a * b) % m if m else 0
+
+
+def exp(base, exponent):
+    if exponent < 2:
+        return base if exponent else 1
+    if base < 2:
+        return base
+    shift = POW2_EXP.get(base)
+    if shift is not None:
+        # 2**k, 256**k etc., as used by compilers for shifting
+        shift *= exponent
+        return 1 << shift if shift < 256 else 0
+    if exponent == 2:
+        return mul(base, base)
+    # repeated squaring reducing every intermediate result mod 2**256
+    return pow(base, exponent, TT256)
+
+
+def exp_bytes(exponent):
+    """Number of bytes of `exponent`, which EXP is charged for."""
+    return (exponent.bit_length() + 7) // 8
+
+
+def signextend(b, x):
+    if b > 31:
+        return x
+    if x & SIGN_BITS[b]:
+        return x | EXTEND_HIGH[b]
+    return x & EXTEND_LOW[b]
@@ -0,0 +1,107 @@
+"""
+A cache of the blocks and headers loaded from the database.
+
+The cache has two tiers, one for headers and one for complete blocks, each
+bounded by the number of bytes of the RLP the cached objects were decoded
+from. Headers are small and read often while walking the chain (e.g. by
+:meth:`ethereum.blocks.Block.get_parent_header`), so many of them stay
+cached even if large blocks compete for the memory of the block tier. Both
+tiers evict the least recently used entries.
+
+Entries are keyed by block hash and the database or environment they were
+loaded from. :meth:`BlockCache.invalidate` drops the entries of blocks
+whose state may no longer be available, e.g. after a reorganization.
+"""
+from collections import OrderedDict
+
+
+class _Tier(object):
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # (blockhash, owner) -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        try:
+            item = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items[key] = item  # most recently used
+        return item[0]
+
+    def put(self, key, value, size):
+        self.remove(key)
+        if size > self.max_bytes:
+            return
+        self.items[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.items.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def remove(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+    def stats(self):
+        return dict(items=len(self.items), size=self.size, max_bytes=self.max_bytes,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+class BlockCache(object):
+
+    """Recently loaded block headers and blocks.
+
+    :param max_header_bytes: size of the RLP of all cached headers
+    :param max_block_bytes: size of the RLP of all cached blocks
+    """
+
+    def __init__(self, max_header_bytes=4 * 1024 * 1024, max_block_bytes=32 * 1024 * 1024):
+        self.headers = _Tier('headers', max_header_bytes)
+        self.blocks = _Tier('blocks', max_block_bytes)
+
+    def get_header(self, db, blockhash):
+        """Return the cached header or `None`."""
+        return self.headers.get((blockhash, db))
+
+    def put_header(self, db, header, size):
+        self.headers.put((header.hash, db), header, size)
+
+    def get_block(self, env, blockhash):
+        """Return the cached block or `None`."""
+        return self.blocks.get((blockhash, env))
+
+    def put_block(self, env, block, size):
+        self.blocks.put((block.hash, env), block, size)
+
+    def invalidate(self, blockhashes):
+        """Drop the headers and blocks with the given hashes."""
+        blockhashes = set(blockhashes)
+        for tier in (self.headers, self.blocks):
+            for key in [k for k in tier.items if k[0] in blockhashes]:
+                tier.remove(key)
+
+    def clear(self):
+        self.headers.clear()
+        self.blocks.clear()
+
+    def stats(self):
+        """Statistics of both tiers as a dict of dicts with the number of
+        items, their size, the hits, misses and evictions."""
+        return dict((tier.name, tier.stats()) for tier in (self.headers, self.blocks))
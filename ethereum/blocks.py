@@ -7,7 +7,7 @@ import time
 from itertools import count
 import sys
 import rlp
-from rlp.sedes import big_endian_int, Binary, binary, CountableList
+from rlp.sedes import big_endian_int, Binary, binary, CountableList, List
 from rlp.utils import decode_hex, encode_hex
 from ethereum import pruning_trie as trie
 from ethereum.pruning_trie import Trie
@@ -15,6 +15,7 @@ from ethereum.securetrie import SecureTrie
 from ethereum import utils
 from ethereum.utils import address, int256, trie_root, hash32, to_string
 from ethereum import processblock
+from ethereum import speculation
 from ethereum.transactions import Transaction
 from ethereum import bloom
 from ethereum.exceptions import UnknownParentException, VerificationFailed
@@ -22,22 +23,21 @@ from ethereum.slogging import get_logger
 from ethereum.ethpow import check_pow
 from ethereum.db import BaseDB
 from ethereum.config import Env, default_config
-
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
+from ethereum.blockcache import BlockCache
 
 
 log = get_logger('eth.block')
 log_state = get_logger('eth.msg.state')
 Log = processblock.Log
 
+# number of ancestor hashes a block inherits from its parent, enough for the
+# BLOCKHASH opcode
+ANCESTOR_HASHES = 256
 
 
 # Difficulty adjustment algo
-def calc_difficulty(parent, timestamp):
-    config = parent.config
+def calc_difficulty(parent, timestamp, config=None):
+    config = config or parent.config
     offset = parent.difficulty // config['BLOCK_DIFF_FACTOR']
     if parent.number >= (config['HOMESTEAD_FORK_BLKNUM'] - 1):
         sign = max(1 - ((timestamp - parent.timestamp) // config['HOMESTEAD_DIFF_ADJUSTMENT_CUTOFF']), -99)
@@ -131,8 +131,10 @@ class Receipt(rlp.Serializable):
 
     @property
     def bloom(self):
-        bloomables = [x.bloomables() for x in self.logs]
-        return bloom.bloom_from_list(utils.flatten(bloomables))
+        value = 0
+        for log in self.logs:
+            value |= log.bloom
+        return value
 
 
 class BlockHeader(rlp.Serializable):
@@ -257,10 +259,27 @@ class BlockHeader(rlp.Serializable):
         else:
             self._receipts_root = value
 
+    def __setattr__(self, attr, value):
+        super(BlockHeader, self).__setattr__(attr, value)
+        if attr in _hash_attributes:
+            d = self.__dict__
+            d.pop('_hash', None)
+            if attr not in ('mixhash', 'nonce'):
+                d.pop('_mining_hash', None)
+
+    def _forget_hashes(self):
+        """Drop the memoized hashes, e.g. because a trie root of the block
+        the header is attached to has changed."""
+        self.__dict__.pop('_hash', None)
+        self.__dict__.pop('_mining_hash', None)
+
     @property
     def hash(self):
         """The binary block hash"""
-        return utils.sha3(rlp.encode(self))
+        h = self.__dict__.get('_hash')
+        if h is None:
+            h = self.__dict__['_hash'] = utils.sha3(rlp.encode(self))
+        return h
 
     def hex_hash(self):
         """The hex encoded block hash"""
@@ -268,7 +287,11 @@ class BlockHeader(rlp.Serializable):
 
     @property
     def mining_hash(self):
-        return utils.sha3(rlp.encode(self, BlockHeader.exclude(['mixhash', 'nonce'])))
+        h = self.__dict__.get('_mining_hash')
+        if h is None:
+            h = self.__dict__['_mining_hash'] = \
+                utils.sha3(rlp.encode(self, _mining_header_sedes))
+        return h
 
     def check_pow(self, nonce=None):
         """Check if the proof-of-work of the block is valid.
@@ -313,6 +336,12 @@ class BlockHeader(rlp.Serializable):
         return not self.__eq__(other)
 
 
+# setting these invalidates the hashes memoized by a header
+_hash_attributes = frozenset([field for field, _ in BlockHeader.fields] +
+                             ['_state_root', '_tx_list_root', '_receipts_root', 'block'])
+_mining_header_sedes = BlockHeader.exclude(['mixhash', 'nonce'])
+
+
 def mirror_from(source, attributes, only_getters=True):
     """Decorator (factory) for classes that mirror some attributes from an
     instance variable.
@@ -339,6 +368,12 @@ def mirror_from(source, attributes, only_getters=True):
     return decorator
 
 
+def _decode_transaction(tx):
+    if isinstance(tx, Transaction):
+        return tx
+    return Transaction.deserialize(tx)
+
+
 @mirror_from('header', set(field for field, _ in BlockHeader.fields) -
              set(['state_root', 'receipts_root', 'tx_list_root']),
              only_getters=False)
@@ -360,6 +395,10 @@ class Block(rlp.Serializable):
                receipts are stored (required)
     :param parent: optional parent which if not given may have to be loaded from
                    the database for replay
+    :param lazy: if the state is known, trust the transaction list root of
+                 the header and build the transaction trie only when it is
+                 needed; `transaction_list` may then contain the transactions
+                 in their serialized form, they are decoded on demand
     """
 
     fields = [
@@ -369,7 +408,7 @@ class Block(rlp.Serializable):
     ]
 
     def __init__(self, header, transaction_list=[], uncles=[], env=None,
-                 parent=None, making=False):
+                 parent=None, making=False, lazy=False):
         assert isinstance(env, Env), "No Env object given"
         assert isinstance(env.db, BaseDB), "No database object given"
         self.env = env # don't re-set after init
@@ -382,10 +421,17 @@ class Block(rlp.Serializable):
         self.suicides = []
         self.logs = []
         self.log_listeners = []
+        # set of the account items and storage slots read (see
+        # `ethereum.speculation`), `None` if not recording
+        self.access_recorder = None
         self.refunds = 0
 
         self.ether_delta = 0
         self._get_transactions_cache = []
+        # (tx list root, transactions) until the transaction trie is built
+        self._lazy_transactions = None
+        # (key, receipt rlp) not yet added to the receipt trie
+        self._pending_receipts = []
 
         # Journaling cache for state tree updates
         self.caches = {
@@ -396,6 +442,8 @@ class Block(rlp.Serializable):
             'all': {}
         }
         self.journal = []
+        # [state root, taken by a snapshot], see `snapshot`
+        self._snapshot_root = [None, False]
 
         if self.number > 0:
             self.ancestor_hashes = [self.prevhash]
@@ -406,20 +454,10 @@ class Block(rlp.Serializable):
         if parent:
             if hasattr(parent, 'db') and self.db != parent.db and self.db.db != parent.db:
                 raise ValueError("Parent lives in different database")
-            if self.prevhash != parent.header.hash:
-                raise ValueError("Block's prevhash and parent's hash do not match")
-            if self.number != parent.header.number + 1:
-                raise ValueError("Block's number is not the successor of its parent number")
-            if not check_gaslimit(parent, self.gas_limit):
-                raise ValueError("Block's gaslimit is inconsistent with its parent's gaslimit")
-            if self.difficulty != calc_difficulty(parent, self.timestamp):
-                raise ValueError("Block's difficulty is inconsistent with its parent's difficulty")
-            if self.gas_used > self.gas_limit:
-                raise ValueError("Gas used exceeds gas limit")
-            if self.timestamp <= parent.header.timestamp:
-                raise ValueError("Timestamp equal to or before parent")
-            if self.timestamp >= 2**256:
-                raise ValueError("Timestamp waaaaaaaaaaayy too large")
+            validate_header(header, parent.header, parent.config)
+        elif len(header.extra_data) > self.config['MAX_EXTRADATA_LENGTH']:
+            raise ValueError("Extra data cannot exceed %d bytes"
+                             % self.config['MAX_EXTRADATA_LENGTH'])
 
         for uncle in uncles:
             assert isinstance(uncle, BlockHeader)
@@ -452,18 +490,27 @@ class Block(rlp.Serializable):
             self.state = SecureTrie(Trie(self.db, parent.state_root))
             self.transaction_count = 0
             self.gas_used = 0
+            if lazy:
+                transaction_list = [_decode_transaction(tx) for tx in transaction_list]
             # replay
-            for tx in transaction_list:
-                success, output = processblock.apply_transaction(self, tx)
+            processblock.prevalidate_transactions(self, transaction_list)
+            if self.env.global_config.get('speculative_execution'):
+                speculation.apply_transactions(self, transaction_list)
+            else:
+                for tx in transaction_list:
+                    success, output = processblock.apply_transaction(self, tx)
             self.finalize()
         else:
             # trust the state root in the header
             self.state = SecureTrie(Trie(self.db, header._state_root))
             self.transaction_count = 0
-            if transaction_list:
+            if lazy:
+                self._lazy_transactions = (header.tx_list_root, transaction_list or [])
+                self.transaction_count = len(self._lazy_transactions[1])
+            elif transaction_list:
                 for tx in transaction_list:
                     self.add_transaction_to_list(tx)
-            if self.transactions.root_hash != header.tx_list_root:
+            if self.tx_list_root != header.tx_list_root:
                 raise ValueError("Transaction list root hash does not match")
             # receipts trie populated by add_transaction_to_list is incorrect
             # (it doesn't know intermediate states), so reset it
@@ -494,7 +541,7 @@ class Block(rlp.Serializable):
         must_equal('uncles_hash', utils.sha3(rlp.encode(uncles)), original_values['uncles_hash'])
         assert header.block is None
         must_equal('state_root', self.state.root_hash, header.state_root)
-        must_equal('tx_list_root', self.transactions.root_hash, header.tx_list_root)
+        must_equal('tx_list_root', self.tx_list_root, header.tx_list_root)
         must_equal('receipts_root', self.receipts.root_hash, header.receipts_root)
         must_equal('bloom', self.bloom, original_values['bloom'])
 
@@ -505,9 +552,6 @@ class Block(rlp.Serializable):
         # Basic consistency verifications
         if not self.check_fields():
             raise ValueError("Block is invalid")
-        if len(to_string(self.header.extra_data)) > self.config['MAX_EXTRADATA_LENGTH']:
-            raise ValueError("Extra data cannot exceed %d bytes" \
-                             % default_config['MAX_EXTRADATA_LENGTH'])
         if self.header.coinbase == '':
             raise ValueError("Coinbase cannot be empty address")
         if not self.state.root_hash_valid():
@@ -555,7 +599,7 @@ class Block(rlp.Serializable):
                              nonce=nonce)
         block = Block(header, [], uncles, env=env or parent.env,
                       parent=parent, making=True)
-        block.ancestor_hashes = [parent.hash] + parent.ancestor_hashes
+        block.ancestor_hashes = [parent.hash] + parent.ancestor_hashes[:ANCESTOR_HASHES - 1]
         block.log_listeners = parent.log_listeners
         return block
 
@@ -571,7 +615,7 @@ class Block(rlp.Serializable):
 
         This is equivalent to ``header.hash``.
         """
-        return utils.sha3(rlp.encode(self.header))
+        return self.header.hash
 
     def hex_hash(self):
         """The hex encoded block hash.
@@ -580,14 +624,51 @@ class Block(rlp.Serializable):
         """
         return encode_hex(self.hash)
 
+    @property
+    def transactions(self):
+        """The transaction trie, built on first access if the block was
+        loaded lazily."""
+        if self._lazy_transactions is not None:
+            tx_list_root, transaction_list = self._lazy_transactions
+            transactions = Trie(self.db, trie.BLANK_ROOT)
+            transactions.update_all([(rlp.encode(i), rlp.encode(tx))
+                                     for i, tx in enumerate(transaction_list)])
+            assert transactions.root_hash == tx_list_root
+            self._transactions = transactions
+            self._lazy_transactions = None
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, value):
+        self._transactions = value
+        self._lazy_transactions = None
+        self.header._forget_hashes()
+
     @property
     def tx_list_root(self):
+        if self._lazy_transactions is not None:
+            return self._lazy_transactions[0]
         return self.transactions.root_hash
 
     @tx_list_root.setter
     def tx_list_root(self, value):
         self.transactions = Trie(self.db, value)
 
+    @property
+    def receipts(self):
+        """The receipt trie, including the receipts of the transactions
+        added since it was last accessed."""
+        if self._pending_receipts:
+            self._receipts.update_all(self._pending_receipts)
+            self._pending_receipts = []
+        return self._receipts
+
+    @receipts.setter
+    def receipts(self, value):
+        self._receipts = value
+        self._pending_receipts = []
+        self.header._forget_hashes()
+
     @property
     def receipts_root(self):
         return self.receipts.root_hash
@@ -603,8 +684,10 @@ class Block(rlp.Serializable):
 
     @state_root.setter
     def state_root(self, value):
+        self._save_snapshot_root()
         self.state = SecureTrie(Trie(self.db, value))
         self.reset_cache()
+        self.header._forget_hashes()
 
     @property
     def uncles_hash(self):
@@ -624,7 +707,7 @@ class Block(rlp.Serializable):
         if len(self.uncles) > self.config['MAX_UNCLES']:
             return False
         for uncle in self.uncles:
-            assert uncle.prevhash in self.db
+            assert has_block(self.db, uncle.prevhash)
             if uncle.number == self.number:
                 log.error("uncle at same block height", block=self)
                 return False
@@ -641,8 +724,8 @@ class Block(rlp.Serializable):
         ineligible.extend([b.header for b in ancestor_chain])
         eligible_ancestor_hashes = [x.hash for x in ancestor_chain[2:]]
         for uncle in self.uncles:
-            parent = get_block(self.env, uncle.prevhash)
-            if uncle.difficulty != calc_difficulty(parent, uncle.timestamp):
+            parent = get_block_header(self.db, uncle.prevhash)
+            if uncle.difficulty != calc_difficulty(parent, uncle.timestamp, self.config):
                 return False
             if not uncle.check_pow():
                 return False
@@ -663,21 +746,28 @@ class Block(rlp.Serializable):
 
         :returns: a list [p(self), p(p(self)), ..., p^n(self)]
         """
-        if n == 0 or self.header.number == 0:
-            return []
-        p = self.get_parent()
-        return [p] + p.get_ancestor_list(n-1)
+        ancestors = []
+        block = self
+        while len(ancestors) < n and block.header.number > 0:
+            block = block.get_parent()
+            ancestors.append(block)
+        return ancestors
 
     def get_ancestor_hash(self, n):
+        """Return the hash of the `n`th ancestor or `None` if it is older
+        than the genesis block.
+
+        The hashes of the last `ANCESTOR_HASHES` ancestors are passed on
+        from parent to child, older ones are found by walking the headers.
+        """
         assert n > 0
-        while len(self.ancestor_hashes) < n:
-            if self.number == len(self.ancestor_hashes) - 1:
-                self.ancestor_hashes.append(None)
+        hashes = self.ancestor_hashes
+        while len(hashes) < n:
+            if len(hashes) >= self.number:
+                hashes.append(None)
             else:
-                self.ancestor_hashes.append(
-                    get_block(self.env,
-                              self.ancestor_hashes[-1]).get_parent().hash)
-        return self.ancestor_hashes[n-1]
+                hashes.append(get_block_header(self.db, hashes[-1]).prevhash)
+        return hashes[n-1]
 
     # def get_ancestor(self, n):
     #     return self.get_block(self.get_ancestor_hash(n))
@@ -713,6 +803,8 @@ class Block(rlp.Serializable):
         if len(address) == 40:
             address = decode_hex(address)
         assert len(address) == 20 or len(address) == 0
+        if self.access_recorder is not None:
+            self.access_recorder.add((param, address))
         if address in self.caches[param]:
             return self.caches[param][address]
         else:
@@ -740,6 +832,8 @@ class Block(rlp.Serializable):
         if prev != value:
             self.journal.append([cache, index, prev, value])
             self.caches[cache][index] = value
+            # the state root of the header changes with the caches
+            self.header._forget_hashes()
 
     def _delta_item(self, address, param, value):
         """Add a value to an account item.
@@ -772,7 +866,9 @@ class Block(rlp.Serializable):
         k = rlp.encode(self.transaction_count)
         self.transactions.update(k, rlp.encode(tx))
         r = self.mk_transaction_receipt(tx)
-        self.receipts.update(k, rlp.encode(r))
+        # the receipt trie is built when it is next needed
+        self._pending_receipts.append((k, rlp.encode(r)))
+        self.header._forget_hashes()
         self.bloom |= r.bloom  # int
         self.transaction_count += 1
 
@@ -781,6 +877,11 @@ class Block(rlp.Serializable):
 
         :raises: :exc:`IndexError` if the transaction does not exist
         """
+        if self._lazy_transactions is not None:
+            transaction_list = self._lazy_transactions[1]
+            if not 0 <= num < len(transaction_list):
+                raise IndexError('Transaction does not exist')
+            return _decode_transaction(transaction_list[num])
         index = rlp.encode(num)
         tx = self.transactions.get(index)
         if tx == trie.BLANK_NODE:
@@ -794,17 +895,17 @@ class Block(rlp.Serializable):
     def get_transactions(self):
         """Build a list of all transactions in this block."""
         num = self.transaction_count
-        if len(self._get_transactions_cache) != num:
-            txs = []
-            for i in range(num):
-                txs.append(self.get_transaction(i))
-            self._get_transactions_cache = txs
-        return self._get_transactions_cache
+        txs = self._get_transactions_cache
+        if len(txs) > num:
+            txs = self._get_transactions_cache = []
+        # transactions are only ever appended, decode the new ones only
+        for i in range(len(txs), num):
+            txs.append(self.get_transaction(i))
+        return txs
 
     def get_transaction_hashes(self):
         "helper to check if blk contains a tx"
-        return [utils.sha3(self.transactions.get(rlp.encode(i)))
-                for i in range(self.transaction_count)]
+        return [tx.hash for tx in self.get_transactions()]
 
     def includes_transaction(self, tx_hash):
         assert isinstance(tx_hash, bytes)
@@ -941,6 +1042,10 @@ class Block(rlp.Serializable):
             address = decode_hex(address)
         assert len(address) == 20
         CACHE_KEY = b'storage:' + address
+        if self.access_recorder is not None:
+            # the storage root is read too, unless the slot is cached
+            self.access_recorder.add((CACHE_KEY, index))
+            self.access_recorder.add(('storage', address))
         if CACHE_KEY in self.caches:
             if index in self.caches[CACHE_KEY]:
                 return self.caches[CACHE_KEY][index]
@@ -971,6 +1076,8 @@ class Block(rlp.Serializable):
         if len(address) == 40:
             address = decode_hex(address)
         assert len(address) == 20
+        if self.access_recorder is not None:
+            self.access_recorder.add(('all', address))
         return len(self.state.get(address)) > 0 or address in self.caches['all']
 
     def add_log(self, log):
@@ -985,6 +1092,7 @@ class Block(rlp.Serializable):
         if len(self.journal) == 0:
             # log_state.trace('delta', changes=[])
             return
+        self._save_snapshot_root()
         addresses = sorted(list(self.caches['all'].keys()))
         for addr in addresses:
             acct = self._get_acct(addr)
@@ -1028,7 +1136,9 @@ class Block(rlp.Serializable):
             address = decode_hex(address)
         assert len(address) == 20
         self.commit_state()
+        self._save_snapshot_root()
         self.state.delete(address)
+        self.header._forget_hashes()
 
     def account_to_dict(self, address, with_storage_root=False,
                         with_storage=True):
@@ -1089,21 +1199,30 @@ class Block(rlp.Serializable):
         self.journal = []
 
     def snapshot(self):
-        """Make a snapshot of the current state to enable later reverting."""
-        return {
-            'state': self.state.root_hash,
-            'gas': self.gas_used,
-            'txs': self.transactions,
-            'txcount': self.transaction_count,
-            'suicides': self.suicides,
-            'logs': self.logs,
-            'refunds': self.refunds,
-            'suicides_size': len(self.suicides),
-            'logs_size': len(self.logs),
-            'journal': self.journal,  # pointer to reference, so is not static
-            'journal_size': len(self.journal),
-            'ether_delta': self.ether_delta
-        }
+        """Make a snapshot of the current state to enable later reverting.
+
+        Only the sizes of the journal, suicide and log lists and the
+        counters are recorded. The state root is not computed here: the
+        snapshot shares a cell which gets the root assigned just before the
+        state trie is changed the next time (see `_save_snapshot_root`).
+        """
+        self._snapshot_root[1] = True
+        return (self._snapshot_root,
+                self.journal, len(self.journal),
+                self.suicides, len(self.suicides),
+                self.logs, len(self.logs),
+                self.refunds, self.gas_used, self.transactions,
+                self.transaction_count, self.ether_delta)
+
+    def _save_snapshot_root(self):
+        """Store the state root for the snapshots taken since it was set.
+
+        Must be called before the state trie is modified.
+        """
+        cell = self._snapshot_root
+        if cell[1]:
+            cell[0] = self.state.root_hash
+            self._snapshot_root = [None, False]
 
     def revert(self, mysnapshot):
         """Revert to a previously made snapshot.
@@ -1111,28 +1230,33 @@ class Block(rlp.Serializable):
         Reverting is for example necessary when a contract runs out of gas
         during execution.
         """
-        self.journal = mysnapshot['journal']
+        (cell, self.journal, journal_size, self.suicides, suicides_size,
+         self.logs, logs_size, self.refunds, self.gas_used, self.transactions,
+         self.transaction_count, self.ether_delta) = mysnapshot
         log_state.trace('reverting')
-        while len(self.journal) > mysnapshot['journal_size']:
-            cache, index, prev, post = self.journal.pop()
-            log_state.trace('%r %r %r %r' % (cache, index, prev, post))
-            if prev is not None:
-                self.caches[cache][index] = prev
-            else:
-                del self.caches[cache][index]
-        self.suicides = mysnapshot['suicides']
-        while len(self.suicides) > mysnapshot['suicides_size']:
-            self.suicides.pop()
-        self.logs = mysnapshot['logs']
-        while len(self.logs) > mysnapshot['logs_size']:
-            self.logs.pop()
-        self.refunds = mysnapshot['refunds']
-        self.state.root_hash = mysnapshot['state']
-        self.gas_used = mysnapshot['gas']
-        self.transactions = mysnapshot['txs']
-        self.transaction_count = mysnapshot['txcount']
+        if cell is self._snapshot_root:
+            while len(self.journal) > journal_size:
+                cache, index, prev, post = self.journal.pop()
+                log_state.trace('%r %r %r %r' % (cache, index, prev, post))
+                if prev is not None:
+                    self.caches[cache][index] = prev
+                else:
+                    del self.caches[cache][index]
+        else:
+            # the state was committed after the snapshot: go back to the
+            # previous root and redo the changes that were uncommitted then
+            self.state.root_hash = cell[0]
+            self._snapshot_root = cell
+            del self.journal[journal_size:]
+            journal = self.journal
+            self.reset_cache()
+            self.journal = journal
+            for cache, index, prev, post in journal:
+                self.caches.setdefault(cache, {})[index] = post
+        del self.suicides[suicides_size:]
+        del self.logs[logs_size:]
         self._get_transactions_cache = []
-        self.ether_delta = mysnapshot['ether_delta']
+        self.header._forget_hashes()
 
     def finalize(self):
         """Apply rewards and commit."""
@@ -1189,8 +1313,7 @@ class Block(rlp.Serializable):
 
     @property
     def mining_hash(self):
-        return utils.sha3(rlp.encode(self.header,
-                                     BlockHeader.exclude(['nonce', 'mixhash'])))
+        return self.header.mining_hash
 
     def get_parent(self):
         """Get the parent of this block."""
@@ -1216,29 +1339,17 @@ class Block(rlp.Serializable):
 
     def has_parent(self):
         """`True` if this block has a known parent, otherwise `False`."""
-        try:
-            self.get_parent()
-            return True
-        except UnknownParentException:
-            return False
+        return self.number > 0 and has_block(self.db, self.prevhash)
 
     def chain_difficulty(self):
         """Get the summarized difficulty.
 
-        If the summarized difficulty is not stored in the database, it will be
-        calculated recursively and put in the database.
+        See :func:`get_chain_difficulty`.
         """
-        if self.is_genesis():
-            return self.difficulty
-        elif b'difficulty:' + encode_hex(self.hash) in self.db:
-            encoded = self.db.get(b'difficulty:' + encode_hex(self.hash))
-            return utils.decode_int(encoded)
-        else:
-            o = self.difficulty + self.get_parent().chain_difficulty()
-            # o += sum([uncle.difficulty for uncle in self.uncles])
-            self.state.db.put_temporarily(
-                b'difficulty:' + encode_hex(self.hash), utils.encode_int(o))
-            return o
+        try:
+            return get_chain_difficulty(self.db, self.header)
+        except KeyError:
+            raise UnknownParentException('missing ancestor of %s' % encode_hex(self.hash))
 
     def __eq__(self, other):
         """Two blocks are equal iff they have the same hash."""
@@ -1277,8 +1388,8 @@ def calc_gaslimit(parent):
     return gl
 
 
-def check_gaslimit(parent, gas_limit):
-    config = parent.config
+def check_gaslimit(parent, gas_limit, config=None):
+    config = config or parent.config
     #  block.gasLimit - parent.gasLimit <= parent.gasLimit / GasLimitBoundDivisor
     gl = parent.gas_limit // config['GASLIMIT_ADJMAX_FACTOR']
     a = bool(abs(gas_limit - parent.gas_limit) <= gl)
@@ -1286,6 +1397,30 @@ def check_gaslimit(parent, gas_limit):
     return a and b
 
 
+def validate_header(header, parent, config):
+    """Check the consistency of a block header with the header of its parent.
+
+    :raises: :exc:`ValueError` if the header is invalid
+    """
+    if header.prevhash != parent.hash:
+        raise ValueError("Block's prevhash and parent's hash do not match")
+    if header.number != parent.number + 1:
+        raise ValueError("Block's number is not the successor of its parent number")
+    if not check_gaslimit(parent, header.gas_limit, config):
+        raise ValueError("Block's gaslimit is inconsistent with its parent's gaslimit")
+    if header.difficulty != calc_difficulty(parent, header.timestamp, config):
+        raise ValueError("Block's difficulty is inconsistent with its parent's difficulty")
+    if header.gas_used > header.gas_limit:
+        raise ValueError("Gas used exceeds gas limit")
+    if header.timestamp <= parent.timestamp:
+        raise ValueError("Timestamp equal to or before parent")
+    if header.timestamp >= 2**256:
+        raise ValueError("Timestamp waaaaaaaaaaayy too large")
+    if len(header.extra_data) > config['MAX_EXTRADATA_LENGTH']:
+        raise ValueError("Extra data cannot exceed %d bytes"
+                         % config['MAX_EXTRADATA_LENGTH'])
+
+
 class CachedBlock(Block):
     # note: immutable refers to: do not manipulate!
     _hash_cached = None
@@ -1318,25 +1453,156 @@ class CachedBlock(Block):
         return blk
 
 
+# A block is stored as three records: its header, its body (transactions
+# and uncles) and its receipts. Blocks stored as a single RLP blob under
+# their hash can still be read.
+_body_sedes = List([CountableList(Transaction), CountableList(BlockHeader)])
+_receipts_sedes = CountableList(Receipt)
+
+
+def _header_key(blockhash):
+    return b'blockheader:' + blockhash
+
+
+def _body_key(blockhash):
+    return b'blockbody:' + blockhash
+
+
+def _receipts_key(blockhash):
+    return b'receipts:' + blockhash
+
+
+def store_block(db, block):
+    """Store the header, the body and the receipts of a block."""
+    put = db.put_temporarily if block.number > 0 else db.put
+    blockhash = block.hash
+    put(_header_key(blockhash), rlp.encode(block.header))
+    put(_body_key(blockhash),
+        rlp.encode([block.get_transactions(), block.uncles], _body_sedes))
+    put(_receipts_key(blockhash), rlp.encode(block.get_receipts(), _receipts_sedes))
+
+
+def get_block_transaction(db, blockhash, index):
+    """Decode a single transaction of a stored block.
+
+    :raises: :exc:`KeyError` if the block is not stored, :exc:`IndexError`
+             if the transaction does not exist
+    """
+    try:
+        data = rlp.descend(db.get(_body_key(blockhash)), 0, index)
+    except KeyError:
+        data = rlp.descend(db.get(blockhash), 1, index)
+    return rlp.decode(data, Transaction)
+
+
+def get_block_transaction_hashes(db, blockhash):
+    """Get the hashes of the transactions of a stored block without
+    decoding them."""
+    try:
+        transaction_list = rlp.decode(db.get(_body_key(blockhash)))[0]
+    except KeyError:
+        transaction_list = rlp.decode(db.get(blockhash))[1]
+    return [utils.sha3(rlp.encode(tx)) for tx in transaction_list]
+
+
+def has_block(db, blockhash):
+    return _header_key(blockhash) in db or blockhash in db
+
+
+def get_block_receipts(db, blockhash):
+    """Get the receipts of a stored block without its receipts trie.
+
+    :raises: :exc:`KeyError` if the receipts are not stored
+    """
+    return rlp.decode(db.get(_receipts_key(blockhash)), _receipts_sedes)
+
+
+def _chain_difficulty_key(blockhash):
+    return b'difficulty:' + encode_hex(blockhash)
+
+
+def get_chain_difficulty(db, header):
+    """Get the total difficulty of the chain ending with `header`.
+
+    The total difficulty is looked up in the index kept by
+    :func:`store_chain_difficulty`. For blocks not in the index, the
+    difficulties of their headers are summed up iteratively until an
+    indexed ancestor or the genesis block is reached.
+
+    :raises: :exc:`KeyError` if an ancestor is not known
+    """
+    total = 0
+    while True:
+        key = _chain_difficulty_key(header.hash)
+        if key in db:
+            return total + utils.decode_int(db.get(key))
+        total += header.difficulty
+        if header.number == 0:
+            return total
+        header = get_block_header(db, header.prevhash)
+
+
+def store_chain_difficulty(db, header):
+    """Add the total difficulty of the chain ending with `header` to the
+    index.
+
+    :returns: the total difficulty
+    """
+    total = get_chain_difficulty(db, header)
+    db.put(_chain_difficulty_key(header.hash), utils.encode_int(total))
+    return total
+
+
+# headers and blocks loaded by `get_block_header` and `get_block`
+block_cache = BlockCache()
+
+
 def get_block_header(db, blockhash):
     assert isinstance(db, BaseDB)
-    bh = BlockHeader.from_block_rlp(db.get(blockhash))
+    bh = block_cache.get_header(db, blockhash)
+    if bh is not None:
+        return bh
+    try:
+        data = db.get(_header_key(blockhash))
+        bh = rlp.decode(data, BlockHeader)
+    except KeyError:
+        data = db.get(blockhash)
+        bh = BlockHeader.from_block_rlp(data)
+        data = rlp.descend(data, 0)
     if bh.hash != blockhash:
         log.warn('BlockHeader.hash is broken')
         assert bh.hash == blockhash
-
+    block_cache.put_header(db, bh, len(data))
     return bh
 
 
-@lru_cache(1024)
 def get_block(env, blockhash):
     """
     Assumption: blocks loaded from the db are not manipulated
                 -> can be cached including hash
     """
     assert isinstance(env, Env)
-    blk = rlp.decode(env.db.get(blockhash), Block, env=env)
-    return CachedBlock.create_cached(blk)
+    blk = block_cache.get_block(env, blockhash)
+    if blk is not None:
+        return blk
+    try:
+        header = env.db.get(_header_key(blockhash))
+        body = env.db.get(_body_key(blockhash))
+        size = len(header) + len(body)
+        header = rlp.decode(header, BlockHeader)
+        transaction_list, uncles = rlp.decode(body)
+    except KeyError:
+        data = env.db.get(blockhash)
+        size = len(data)
+        header, transaction_list, uncles = rlp.decode(data)
+        header = BlockHeader.deserialize(header)
+    # the transactions are decoded on demand
+    blk = Block(header, transaction_list, [BlockHeader.deserialize(u) for u in uncles],
+                env=env, lazy=True)
+    blk._mutable = False
+    blk = CachedBlock.create_cached(blk)
+    block_cache.put_block(env, blk, size)
+    return blk
 
 
 # def has_block(blockhash):
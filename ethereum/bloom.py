@@ -35,12 +35,17 @@ def bloom_insert(bloom, val):
 
 def bloom_bits(val):
     h = utils.sha3(val)
-    return [bits_in_number(1 << ((safe_ord(h[i + 1]) + (safe_ord(h[i]) << 8)) & 2047)) for i in range(0, BUCKETS_PER_VAL * 2, 2)]
+    return [[(safe_ord(h[i + 1]) + (safe_ord(h[i]) << 8)) & 2047] for i in range(0, BUCKETS_PER_VAL * 2, 2)]
 
 
 def bits_in_number(val):
     assert is_numeric(val)
-    return [n for n in range(2048) if (1 << n) & val]
+    bits = []
+    while val:
+        lowest = val & -val
+        bits.append(lowest.bit_length() - 1)
+        val ^= lowest
+    return bits
 
 
 def bloom_query(bloom, val):
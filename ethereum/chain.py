@@ -8,7 +8,10 @@ from ethereum.utils import to_string, is_string
 import rlp
 from rlp.utils import encode_hex
 from ethereum import blocks
+from ethereum.bloom import bits_in_number
 from ethereum import processblock
+from ethereum import opcodes
+from ethereum.txpool import TransactionPool
 from ethereum.slogging import get_logger
 from ethereum.config import Env
 import sys
@@ -24,11 +27,29 @@ class Index(object):
         - needed to get the uncles of a block
     blocknumbers:
         - needed to mark the longest chain (path to top)
+        - entries above the number of the head are stale: they are not
+          deleted (which would only lower their refcount in a
+          `RefcountDB`), but ignored and overwritten later
     transactions:
         - optional to resolve txhash to block:tx
+        - only for the blocks of the longest chain, updated with the
+          blocknumbers
+        - written with `put_temporarily`, so that rewriting an entry on a
+          reorg does not change its refcount in a `RefcountDB`
+    bloom bits:
+        - the blooms of the blocks of the longest chain, bit-sliced: for
+          each section of `bloom_section_size` blocks and each of the 2048
+          bloom bits a vector with a bit set for each block of the section
+          whose bloom has that bit set
+        - updated with the blocknumbers
+        - for a database indexed before, only the blocks from
+          `bloom_bits_start` on, older ones are added by
+          `backfill_bloom_bits`
 
     """
 
+    bloom_section_size = 4096
+
     def __init__(self, env, index_transactions=True):
         assert isinstance(env, Env)
         self.env = env
@@ -37,68 +58,189 @@ class Index(object):
 
     def add_block(self, blk):
         self.add_child(blk.prevhash, blk.hash)
-        if self._index_transactions:
-            self._add_transactions(blk)
 
     # block by number #########
     def _block_by_number_key(self, number):
         return 'blocknumber:%d' % number
 
+    _max_number_key = b'blocknumber:max'
+
+    def _max_number(self):
+        "number of the head, -1 before the genesis is indexed"
+        try:
+            return utils.decode_int(self.db.get(self._max_number_key))
+        except KeyError:
+            pass
+        # indexed without the record, the numbers have no gaps; scanned once
+        number = -1
+        while self._block_by_number_key(number + 1) in self.db:
+            number += 1
+        if number >= 0:
+            self.db.put(self._max_number_key, utils.encode_int(number))
+        return number
+
     def update_blocknumbers(self, blk):
         "start from head and update until the existing indices match the block"
+        if self._bloom_bits_start_key not in self.db:
+            # the blocks indexed so far have no bloom bits
+            self.db.put(self._bloom_bits_start_key, utils.encode_int(self.bloom_bits_start()))
+        # drop the numbers beyond a new head with a lower number
+        for number in range(blk.number + 1, self._max_number() + 1):
+            self._remove_block(number, self.get_block_by_number(number))
+        header = blk.header
         while True:
-            if blk.number > 0:
-                self.db.put_temporarily(self._block_by_number_key(blk.number), blk.hash)
-            else:
-                self.db.put(self._block_by_number_key(blk.number), blk.hash)
-            self.db.commit_refcount_changes(blk.number)
-            if blk.number == 0:
-                break
-            blk = blk.get_parent()
-            if self.has_block_by_number(blk.number) and \
-                    self.get_block_by_number(blk.number) == blk.hash:
+            if self.has_block_by_number(header.number):
+                old_hash = self.get_block_by_number(header.number)
+                if old_hash == header.hash:
+                    break
+                self._remove_block(header.number, old_hash)
+            self.db.put(self._block_by_number_key(header.number), header.hash)
+            self._add_transactions(header.hash)
+            self._update_bloom_bits(header.number, header.bloom, True)
+            if header.number == 0:
                 break
+            header = blocks.get_block_header(self.db, header.prevhash)
+        self.db.put(self._max_number_key, utils.encode_int(blk.number))
 
     def has_block_by_number(self, number):
-        return self._block_by_number_key(number) in self.db
+        return 0 <= number <= self._max_number()
 
     def get_block_by_number(self, number):
         "returns block hash"
+        if not self.has_block_by_number(number):
+            raise KeyError(number)
         return self.db.get(self._block_by_number_key(number))
 
+    def _remove_block(self, number, blockhash):
+        "drop the entries of a block that leaves the longest chain"
+        self._remove_transactions(blockhash)
+        self._update_bloom_bits(number, blocks.get_block_header(self.db, blockhash).bloom, False)
+
+    # bloom bits ##########
+    def _bloom_bits_key(self, section, bit):
+        return b'bloombits:%d:%d' % (section, bit)
+
+    _bloom_bits_start_key = b'bloombits:start'
+
+    def bloom_bits_start(self):
+        """Number of the first block whose bloom is in the bloom bits, the
+        blooms of all later blocks of the longest chain are too."""
+        try:
+            return utils.decode_int(self.db.get(self._bloom_bits_start_key))
+        except KeyError:
+            return self._max_number() + 1
+
+    def backfill_bloom_bits(self, count=None):
+        """Add the blooms of the blocks before `bloom_bits_start`.
+
+        :param count: the maximum number of blocks to add, all by default
+        :returns: the new `bloom_bits_start`
+        """
+        start = min(self.bloom_bits_start(), self._max_number() + 1)
+        stop = 0 if count is None else max(0, start - count)
+        for number in range(start - 1, stop - 1, -1):
+            header = blocks.get_block_header(self.db, self.get_block_by_number(number))
+            self._update_bloom_bits(number, header.bloom, True)
+        if stop < start:
+            self.db.put(self._bloom_bits_start_key, utils.encode_int(stop))
+        return stop
+
+    def _update_bloom_bits(self, number, bloom, value):
+        section, position = divmod(number, self.bloom_section_size)
+        for bit in bits_in_number(bloom):
+            vector = self.get_bloom_bits(section, bit)
+            if value:
+                vector |= 1 << position
+            else:
+                vector &= ~(1 << position)
+            self.db.put(self._bloom_bits_key(section, bit), utils.int_to_big_endian(vector))
+
+    def get_bloom_bits(self, section, bit):
+        """Return the blocks of a section whose blooms have `bit` set.
+
+        :returns: an integer with bit ``n`` set for the block with number
+                  ``section * bloom_section_size + n``
+        """
+        try:
+            return utils.big_endian_to_int(self.db.get(self._bloom_bits_key(section, bit)))
+        except KeyError:
+            return 0
+
     # transactions #############
-    def _add_transactions(self, blk):
+    def _add_transactions(self, blockhash):
         "'tx_hash' -> 'rlp([blockhash,tx_number])"
-        for i, tx in enumerate(blk.get_transactions()):
-            self.db.put_temporarily(tx.hash, rlp.encode([blk.hash, i]))
-        self.db.commit_refcount_changes(blk.number)
+        if not self._index_transactions:
+            return
+        for i, txhash in enumerate(blocks.get_block_transaction_hashes(self.db, blockhash)):
+            self.db.put_temporarily(txhash, rlp.encode([blockhash, i]))
+
+    def _remove_transactions(self, blockhash):
+        "empty the entries of a block that left the longest chain"
+        if not self._index_transactions:
+            return
+        for txhash in blocks.get_block_transaction_hashes(self.db, blockhash):
+            try:
+                entry = self.db.get(txhash)
+            except KeyError:
+                continue
+            # unless the transaction was indexed for a block of the new chain
+            if entry and rlp.decode(entry)[0] == blockhash:
+                self.db.put_temporarily(txhash, b'')
 
     def get_transaction(self, txhash):
         "return (tx, block, index)"
-        blockhash, tx_num_enc = rlp.decode(self.db.get(txhash))
-        blk = rlp.decode(self.db.get(blockhash), blocks.Block, env=self.env)
+        # missing (KeyError) or emptied on a reorg: not indexed
+        entry = self.db.get(txhash)
+        if not entry:
+            raise KeyError(txhash)
+        blockhash, tx_num_enc = rlp.decode(entry)
         num = utils.decode_int(tx_num_enc)
-        tx_data = blk.get_transaction(num)
-        return tx_data, blk, num
+        tx_data = blocks.get_block_transaction(self.db, blockhash, num)
+        return tx_data, blocks.get_block(self.env, blockhash), num
 
     # children ##############
 
+    # children are stored one entry per key, numbered in the order they were
+    # added; lists of all children under b'ci:' + hash are still read
     def _child_db_key(self, blk_hash):
         return b'ci:' + blk_hash
 
-    def add_child(self, parent_hash, child_hash):
-        # only efficient for few children per block
-        children = list(set(self.get_children(parent_hash) + [child_hash]))
-        assert children.count(child_hash) == 1
-        self.db.put_temporarily(self._child_db_key(parent_hash), rlp.encode(children))
+    def _num_children_key(self, blk_hash):
+        return b'cn:' + blk_hash
 
-    def get_children(self, blk_hash):
-        "returns block hashes"
+    def _nth_child_key(self, blk_hash, n):
+        return b'ci:%d:' % n + blk_hash
+
+    def _parent_db_key(self, child_hash):
+        return b'cp:' + child_hash
+
+    def _num_children(self, blk_hash):
+        key = self._num_children_key(blk_hash)
+        if key in self.db:
+            return utils.decode_int(self.db.get(key))
+        return 0
+
+    def _old_children(self, blk_hash):
         key = self._child_db_key(blk_hash)
         if key in self.db:
             return rlp.decode(self.db.get(key))
         return []
 
+    def add_child(self, parent_hash, child_hash):
+        key = self._parent_db_key(child_hash)
+        if key in self.db or child_hash in self._old_children(parent_hash):
+            return
+        n = self._num_children(parent_hash)
+        self.db.put_temporarily(self._nth_child_key(parent_hash, n), child_hash)
+        self.db.put_temporarily(self._num_children_key(parent_hash), utils.encode_int(n + 1))
+        self.db.put_temporarily(key, parent_hash)
+
+    def get_children(self, blk_hash):
+        "returns block hashes"
+        return self._old_children(blk_hash) + \
+            [self.db.get(self._nth_child_key(blk_hash, n))
+             for n in range(self._num_children(blk_hash))]
+
 
 class Chain(object):
 
@@ -107,8 +249,11 @@ class Chain(object):
 
     :ivar head_candidate: the block which if mined by our miner would become
                           the new head
+    :ivar transaction_pool: the pending transactions the head candidate is
+                            built from
     """
-    head_candidate = None
+    _head_candidate = None
+    _head_candidate_finalized = False
 
     def __init__(self, env, genesis=None, new_head_cb=None, coinbase='\x00' * 20):
         assert isinstance(env, Env)
@@ -116,6 +261,7 @@ class Chain(object):
         self.db = self.blockchain = env.db
         self.new_head_cb = new_head_cb
         self.index = Index(self.env)
+        self.transaction_pool = TransactionPool()
         self._coinbase = coinbase
         if 'HEAD' not in self.db:
             self._initialize_blockchain(genesis)
@@ -139,7 +285,7 @@ class Chain(object):
 
     @property
     def coinbase(self):
-        assert self.head_candidate.coinbase == self._coinbase
+        assert self._head_candidate.coinbase == self._coinbase
         return self._coinbase
 
     @coinbase.setter
@@ -176,17 +322,22 @@ class Chain(object):
             b_children = []
             if b.hash != h.hash:
                 log.warn('reverting')
+                reverted = []
                 while h.number > b.number:
                     h.state.db.revert_refcount_changes(h.number)
+                    reverted.append(h.hash)
                     h = h.get_parent()
                 while b.number > h.number:
                     b_children.append(b)
                     b = b.get_parent()
                 while b.hash != h.hash:
                     h.state.db.revert_refcount_changes(h.number)
+                    reverted.append(h.hash)
                     h = h.get_parent()
                     b_children.append(b)
                     b = b.get_parent()
+                # the state of the reverted blocks may be pruned
+                blocks.block_cache.invalidate(reverted)
                 for bc in b_children:
                     processblock.verify(bc, bc.get_parent())
         self.blockchain.put('HEAD', block.hash)
@@ -203,7 +354,7 @@ class Chain(object):
         log.debug('updating head candidate', head=self.head)
         # collect uncles
         blk = self.head  # parent of the block we are collecting uncles for
-        uncles = set(u.header for u in self.get_brothers(blk))
+        uncles = set(self.get_uncle_candidates(blk))
         for i in range(self.env.config['MAX_UNCLE_DEPTH'] + 2):
             for u in blk.uncles:
                 assert isinstance(u, blocks.BlockHeader)
@@ -220,23 +371,67 @@ class Chain(object):
                                                        timestamp=ts, uncles=uncles, env=_env)
         assert head_candidate.validate_uncles()
 
+        # add pending transactions, then finalize once
+        pool = self.transaction_pool
+        pool.prune(head_candidate.get_nonce)
+        if forward_pending_transactions:
+            if len(pool):
+                log.debug('forwarding pending transactions', num=len(pool))
+            self._apply_pending_transactions(head_candidate, pool.ordered(head_candidate.get_nonce))
+        elif len(pool):
+            log.debug('discarding pending transactions', num=len(pool))
+            pool.clear()
+        self._head_candidate = head_candidate
+        self._head_candidate_finalized = False
+
+    @property
+    def head_candidate(self):
+        """The block which if mined by our miner would become the new head.
+
+        The rewards are applied lazily, when the candidate is requested. A
+        transaction added afterwards is applied to the same block object,
+        which is then finalized again right away.
+        """
+        if self._head_candidate is not None and not self._head_candidate_finalized:
+            self._finalize_head_candidate()
+        return self._head_candidate
+
+    def _finalize_head_candidate(self):
+        head_candidate = self._head_candidate
         self.pre_finalize_state_root = head_candidate.state_root
+        self._pre_finalize_ether_delta = head_candidate.ether_delta
         head_candidate.finalize()
+        self._head_candidate_finalized = True
 
-        # add transactions from previous head candidate
-        old_head_candidate = self.head_candidate
-        self.head_candidate = head_candidate
-        if old_head_candidate is not None:
-            tx_hashes = self.head.get_transaction_hashes()
-            pending = [tx for tx in old_head_candidate.get_transactions()
-                       if tx.hash not in tx_hashes]
-            if pending:
-                if forward_pending_transactions:
-                    log.debug('forwarding pending transactions', num=len(pending))
-                    for tx in pending:
-                        self.add_transaction(tx)
-                else:
-                    log.debug('discarding pending transactions', num=len(pending))
+    def _unfinalized_head_candidate(self):
+        head_candidate = self._head_candidate
+        if self._head_candidate_finalized:
+            head_candidate.state_root = self.pre_finalize_state_root
+            head_candidate.ether_delta = self._pre_finalize_ether_delta
+            self._head_candidate_finalized = False
+        return head_candidate
+
+    def _apply_pending_transactions(self, head_candidate, txs):
+        """Apply pool transactions to the unfinalized `head_candidate`.
+
+        Transactions that are invalid on the candidate are dropped from the
+        pool, unless they only lack the gas left in the block.
+
+        :returns: the number of transactions applied
+        """
+        num = 0
+        for tx in txs:
+            if head_candidate.gas_limit - head_candidate.gas_used < opcodes.GTXCOST:
+                break
+            try:
+                processblock.apply_transaction(head_candidate, tx)
+                num += 1
+            except processblock.BlockGasLimitReached:
+                log.debug('tx does not fit into block', tx=tx)
+            except processblock.InvalidTransaction as e:
+                log.debug('dropping invalid tx', tx=tx, error=e)
+                self.transaction_pool.remove(tx)
+        return num
 
     def get_uncles(self, block):
         """Return the uncles of `block`."""
@@ -247,13 +442,19 @@ class Chain(object):
 
     def get_brothers(self, block):
         """Return the uncles of the hypothetical child of `block`."""
+        return [self.get(header.hash) for header in self.get_uncle_candidates(block)]
+
+    def get_uncle_candidates(self, block):
+        """Return the headers of the uncles of the hypothetical child of
+        `block`, without loading any blocks."""
         o = []
-        i = 0
-        while block.has_parent() and i < self.env.config['MAX_UNCLE_DEPTH']:
-            parent = block.get_parent()
-            o.extend([u for u in self.get_children(parent) if u != block])
-            block = block.get_parent()
-            i += 1
+        header = block.header
+        for i in range(self.env.config['MAX_UNCLE_DEPTH']):
+            if header.number == 0 or not self.has_block(header.prevhash):
+                break
+            o.extend(blocks.get_block_header(self.db, h)
+                     for h in self.index.get_children(header.prevhash) if h != header.hash)
+            header = blocks.get_block_header(self.db, header.prevhash)
         return o
 
     def get(self, blockhash):
@@ -262,22 +463,26 @@ class Chain(object):
         return blocks.get_block(self.env, blockhash)
 
     def get_bloom(self, blockhash):
-        h = rlp.decode(rlp.descend(self.db.get(blockhash), 0, 6))
-        return utils.big_endian_to_int(h)
+        return blocks.get_block_header(self.db, blockhash).bloom
+
+    def get_receipts(self, blockhash):
+        """Return the receipts of a block without loading the block.
+
+        :raises: :exc:`KeyError` if the block is not known
+        """
+        return blocks.get_block_receipts(self.db, blockhash)
 
     def has_block(self, blockhash):
         assert is_string(blockhash)
         assert len(blockhash) == 32
-        return blockhash in self.blockchain
+        return blocks.has_block(self.blockchain, blockhash)
 
     def __contains__(self, blockhash):
         return self.has_block(blockhash)
 
     def _store_block(self, block):
-        if block.number > 0:
-            self.blockchain.put_temporarily(block.hash, rlp.encode(block))
-        else:
-            self.blockchain.put(block.hash, rlp.encode(block))
+        blocks.store_block(self.blockchain, block)
+        blocks.store_chain_difficulty(self.blockchain, block.header)
 
     def commit(self):
         self.blockchain.commit()
@@ -299,8 +504,17 @@ class Chain(object):
             return False
 
         if block.has_parent():
+            parent = block.get_parent()
             try:
-                processblock.verify(block, block.get_parent())
+                if block.db is self.db:
+                    # the block was built on our database, which executed
+                    # and checked its transactions against the header (or
+                    # found it validated before), so its state is reused
+                    blocks.validate_header(block.header, parent.header, parent.config)
+                else:
+                    # e.g. a mined head candidate, whose state only exists
+                    # in its overlay
+                    processblock.verify(block, parent)
             except processblock.VerificationFailed as e:
                 _log.critical('VERIFICATION FAILED', error=e)
                 f = os.path.join(utils.data_dir, 'badblock.log')
@@ -315,13 +529,15 @@ class Chain(object):
         self._store_block(block)
 
         # set to head if this makes the longest chain w/ most work for that number
-        if block.chain_difficulty() > self.head.chain_difficulty():
+        block_difficulty = block.chain_difficulty()
+        head_difficulty = self.head.chain_difficulty()
+        if block_difficulty > head_difficulty:
             _log.debug('new head', num_tx=block.num_transactions())
             self._update_head(block, forward_pending_transactions)
         elif block.number > self.head.number:
             _log.warn('has higher blk number than head but lower chain_difficulty',
-                      head_hash=self.head, block_difficulty=block.chain_difficulty(),
-                      head_difficulty=self.head.chain_difficulty())
+                      head_hash=self.head, block_difficulty=block_difficulty,
+                      head_difficulty=head_difficulty)
         block.transactions.clear_all()
         block.receipts.clear_all()
         block.state.db.commit_refcount_changes(block.number)
@@ -333,58 +549,95 @@ class Chain(object):
         return [self.get(c) for c in self.index.get_children(block.hash)]
 
     def add_transaction(self, transaction):
-        """Add a transaction to the :attr:`head_candidate` block.
+        """Add a transaction to the :attr:`transaction_pool` and the
+        :attr:`head_candidate` block.
 
-        If the transaction is invalid, the block will not be changed.
+        Transactions with a nonce ahead of their sender's are kept in the
+        pool until the gap is filled. If the transaction is invalid, the
+        block will not be changed.
 
-        :returns: `True` is the transaction was successfully added or `False`
-                  if the transaction was invalid
+        :returns: `True` is the transaction was successfully added to the
+                  block or `False` if the transaction was invalid, rejected
+                  by the pool or is waiting for a lower nonce
         """
-        assert self.head_candidate is not None
-        head_candidate = self.head_candidate
+        assert self._head_candidate is not None
+        head_candidate = self._head_candidate
+        pool = self.transaction_pool
         log.debug('add tx', num_txs=self.num_transactions(), tx=transaction, on=head_candidate)
-        if self.head_candidate.includes_transaction(transaction.hash):
+        if transaction.hash in pool or \
+                head_candidate.includes_transaction(transaction.hash):
             log.debug('known tx')
             return
-        old_state_root = head_candidate.state_root
-        # revert finalization
-        head_candidate.state_root = self.pre_finalize_state_root
+        try:
+            replaced = pool.get(transaction.sender, transaction.nonce)
+            if not pool.add(transaction):
+                return False
+        except processblock.InvalidTransaction as e:
+            log.debug('invalid tx', error=e)
+            return False
+        if replaced is not None and head_candidate.includes_transaction(replaced.hash):
+            log.debug('replacing tx, rebuilding head candidate', replaced=replaced)
+            self._update_head_candidate()
+            return self._head_candidate.includes_transaction(transaction.hash)
+
+        # revert finalization, if the candidate was requested since; it is
+        # finalized again, as the caller may still hold it
+        finalized = self._head_candidate_finalized
+        self._unfinalized_head_candidate()
+        try:
+            return self._add_to_head_candidate(head_candidate, transaction)
+        finally:
+            if finalized and head_candidate is self._head_candidate:
+                self._finalize_head_candidate()
+            elif finalized:
+                head_candidate.finalize()
+
+    def _add_to_head_candidate(self, head_candidate, transaction):
+        pool = self.transaction_pool
         try:
             success, output = processblock.apply_transaction(head_candidate, transaction)
         except processblock.InvalidTransaction as e:
             # if unsuccessful the prerequisites were not fullfilled
             # and the tx is invalid, state must not have changed
             log.debug('invalid tx', error=e)
-            head_candidate.state_root = old_state_root  # reset
+            future_nonce = isinstance(e, processblock.InvalidNonce) and \
+                transaction.nonce > head_candidate.get_nonce(transaction.sender)
+            if not future_nonce and not isinstance(e, processblock.BlockGasLimitReached):
+                pool.remove(transaction)
             return False
 
         log.debug('valid tx')
 
         # we might have a new head_candidate (due to ctx switches in pyethapp)
-        if self.head_candidate != head_candidate:
+        if self._head_candidate is not head_candidate:
             log.debug('head_candidate changed during validation, trying again')
+            pool.remove(transaction)
             self.add_transaction(transaction)
             return
 
-        self.pre_finalize_state_root = head_candidate.state_root
-        head_candidate.finalize()
+        # queued transactions of the sender may have become executable
+        nonce = transaction.nonce + 1
+        successor = pool.get(transaction.sender, nonce)
+        while successor is not None and \
+                self._apply_pending_transactions(head_candidate, [successor]):
+            nonce += 1
+            successor = pool.get(transaction.sender, nonce)
         log.debug('tx applied', result=output)
-        assert old_state_root != head_candidate.state_root
         return True
 
     def get_transactions(self):
         """Get a list of new transactions not yet included in a mined block
         but known to the chain.
         """
-        if self.head_candidate:
-            log.debug('get_transactions called', on=self.head_candidate)
-            return self.head_candidate.get_transactions()
+        if self._head_candidate:
+            log.debug('get_transactions called', on=self._head_candidate)
+            return self._head_candidate.get_transactions()
         else:
             return []
 
     def num_transactions(self):
-        if self.head_candidate:
-            return self.head_candidate.transaction_count
+        if self._head_candidate:
+            return self._head_candidate.transaction_count
         else:
             return 0
 
@@ -394,7 +647,7 @@ class Chain(object):
         blocks = []
         block = self.head
         if start:
-            if start not in self.index.db:
+            if not self.has_block(start):
                 return []
             block = self.get(start)
             if not self.in_main_branch(block):
@@ -103,6 +103,7 @@ def preprocess_code(code):
     assert isinstance(code, bytes)
     code = memoryview(code).tolist()
     ops = {}
+    jumpdests = bytearray(len(code))
     cur_chunk = []
     cc_init_pos = 0
     cc_gas_consumption = 0
@@ -114,7 +115,9 @@ def preprocess_code(code):
         op, in_args, out_args, fee = \
             copy.copy(opcodes.opcodes.get(code[i], ['INVALID', 0, 0, 0]))
         opcode, pushval = code[i], 0
-        if op[:4] == 'PUSH':
+        if op == 'JUMPDEST':
+            jumpdests[i] = 1
+        elif op[:4] == 'PUSH':
             for j in range(int(op[4:])):
                 i += 1
                 byte = code[i] if i < len(code) else 0
@@ -142,7 +145,7 @@ def preprocess_code(code):
             cc_min_req_stack = 0
             cc_max_req_stack = 1024
     ops[i] = (0, 0, 1024, [0], 0)
-    return ops
+    return ops, jumpdests
 
 
 def mem_extend(mem, compustate, op, start, sz):
@@ -198,10 +201,9 @@ def vm_execute(ext, msg, code):
     mem = compustate.memory
 
     if code in code_cache:
-        processed_code = code_cache[code]
+        processed_code, jumpdests = code_cache[code]
     else:
-        processed_code = preprocess_code(code)
-        code_cache[code] = processed_code
+        processed_code, jumpdests = code_cache[code] = preprocess_code(code)
 
     s = time.time()
     op = None
@@ -471,17 +473,13 @@ def vm_execute(ext, msg, code):
                 ext.set_storage_data(msg.to, s0, s1)
             elif op == op_JUMP:
                 compustate.pc = stk.pop()
-                opnew = processed_code[compustate.pc][4] if \
-                    compustate.pc in processed_code else op_STOP
-                if opnew != op_JUMPDEST:
+                if compustate.pc >= len(jumpdests) or not jumpdests[compustate.pc]:
                     return vm_exception('BAD JUMPDEST')
             elif op == op_JUMPI:
                 s0, s1 = stk.pop(), stk.pop()
                 if s1:
                     compustate.pc = s0
-                    opnew = processed_code[compustate.pc][4] if \
-                        compustate.pc in processed_code else op_STOP
-                    if opnew != op_JUMPDEST:
+                    if s0 >= len(jumpdests) or not jumpdests[s0]:
                         return vm_exception('BAD JUMPDEST')
             elif op == op_PC:
                 stk.append(compustate.pc - 1)
@@ -0,0 +1,216 @@
+"""
+Header-first synchronization.
+
+:class:`HeaderChain` stores and validates block headers without their
+bodies: the link to the parent, difficulty, gas limit, timestamp and extra
+data (see :func:`ethereum.blocks.validate_header`) and the proof of work,
+which is checked in parallel for a batch of headers. It tracks the header
+chain with the most total difficulty.
+
+Once the header chain is known, the bodies are fetched and executed in a
+separate phase: :meth:`HeaderChain.pending` lists the headers of the best
+header chain whose blocks are not yet part of a
+:class:`ethereum.chain.Chain` and :meth:`HeaderChain.import_body` turns a
+header and its body into a block and adds it to that chain.
+"""
+import multiprocessing
+
+import rlp
+from rlp.sedes import big_endian_int
+from ethereum import blocks
+from ethereum import ethpow
+from ethereum.blocks import BlockHeader
+from ethereum.exceptions import InvalidTransaction, VerificationFailed
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.headerchain')
+
+# check the proof of work in a pool of worker processes from this many
+# headers on
+PARALLEL_POW_MIN_HEADERS = 16
+
+
+def _check_pow(args):
+    return ethpow.check_pow(*args)
+
+
+def check_pow(headers, pool=None):
+    """Check the proof of work of many headers at once.
+
+    :param pool: a `multiprocessing.Pool` owned by the caller to check in,
+                 if there are at least `PARALLEL_POW_MIN_HEADERS` headers.
+                 By default they are checked in the calling process.
+    :returns: a list of `True` or `False` for the headers
+    """
+    args = [(h.number, h.mining_hash, h.mixhash, h.nonce, h.difficulty)
+            for h in headers]
+    if pool is not None and len(args) >= PARALLEL_POW_MIN_HEADERS:
+        return pool.map(_check_pow, args)
+    return [_check_pow(a) for a in args]
+
+
+class HeaderChain(object):
+
+    """Validated block headers, indexed by hash and by number along the
+    header chain with the most total difficulty.
+
+    :param env: the :class:`ethereum.config.Env` the headers are stored in
+    :param genesis: the genesis block or its header
+    :param pow_processes: number of worker processes :meth:`add_headers`
+                          checks the proof of work of large batches in, by
+                          default none. The pool only lives while a batch
+                          is checked.
+    """
+
+    head_key = b'HEADERHEAD'
+
+    def __init__(self, env, genesis, pow_processes=0):
+        self.env = env
+        self.pow_processes = pow_processes
+        self.db = env.db
+        if isinstance(genesis, blocks.Block):
+            genesis = genesis.header
+        if self.head_key not in self.db:
+            self._store(genesis, genesis.difficulty)
+            self.db.put(self._number_key(0), genesis.hash)
+            self.db.put(self.head_key, genesis.hash)
+            self.db.commit()
+        self.genesis = self.get_header(self.get_hash_by_number(0))
+
+    def _header_key(self, blockhash):
+        return b'header:' + blockhash
+
+    def _td_key(self, blockhash):
+        return b'headertd:' + blockhash
+
+    def _number_key(self, number):
+        return b'headernumber:%d' % number
+
+    def _store(self, header, total_difficulty):
+        self.db.put(self._header_key(header.hash), rlp.encode(header))
+        self.db.put(self._td_key(header.hash), rlp.encode(total_difficulty))
+
+    def __contains__(self, blockhash):
+        return self._header_key(blockhash) in self.db
+
+    def get_header(self, blockhash):
+        """:raises: :exc:`KeyError` if the header is not known"""
+        return rlp.decode(self.db.get(self._header_key(blockhash)), BlockHeader)
+
+    def get_total_difficulty(self, blockhash):
+        return rlp.decode(self.db.get(self._td_key(blockhash)), big_endian_int)
+
+    def get_hash_by_number(self, number):
+        """Hash of the header with `number` on the best header chain.
+
+        :raises: :exc:`KeyError` if the chain is shorter
+        """
+        return self.db.get(self._number_key(number))
+
+    @property
+    def head(self):
+        """The last header of the chain with the most total difficulty."""
+        return self.get_header(self.db.get(self.head_key))
+
+    def add_headers(self, headers):
+        """Validate and store a batch of consecutive headers.
+
+        Headers are added up to the first invalid one, the first header
+        must be the child of a known one.
+
+        :returns: the number of headers added
+        """
+        if not headers:
+            return 0
+        if headers[0].prevhash not in self:
+            log.debug('missing parent', header=headers[0])
+            return 0
+        parent = self.get_header(headers[0].prevhash)
+        linked = []
+        for header in headers:
+            try:
+                blocks.validate_header(header, parent, self.env.config)
+            except ValueError as e:
+                log.debug('invalid header', header=header, error=e)
+                break
+            linked.append(header)
+            parent = header
+        valid = linked
+        for i, ok in enumerate(self._check_pow(linked)):
+            if not ok:
+                log.debug('invalid pow', header=linked[i])
+                valid = linked[:i]
+                break
+        if not valid:
+            return 0
+        td = self.get_total_difficulty(valid[0].prevhash)
+        for header in valid:
+            td += header.difficulty
+            self._store(header, td)
+        if td > self.get_total_difficulty(self.db.get(self.head_key)):
+            self._set_head(valid[-1])
+        self.db.commit()
+        log.debug('added headers', num=len(valid), head=self.head)
+        return len(valid)
+
+    def _check_pow(self, headers):
+        if self.pow_processes < 2 or len(headers) < PARALLEL_POW_MIN_HEADERS:
+            return check_pow(headers)
+        pool = multiprocessing.Pool(self.pow_processes)
+        try:
+            return check_pow(headers, pool)
+        finally:
+            pool.terminate()
+
+    def _set_head(self, header):
+        # index the new best chain until it joins the old one
+        self.db.put(self.head_key, header.hash)
+        while True:
+            key = self._number_key(header.number)
+            if key in self.db and self.db.get(key) == header.hash:
+                break
+            self.db.put(key, header.hash)
+            if header.number == 0:
+                break
+            header = self.get_header(header.prevhash)
+        # drop the numbers beyond a shorter new head
+        number = self.head.number + 1
+        while self._number_key(number) in self.db:
+            self.db.delete(self._number_key(number))
+            number += 1
+
+    def pending(self, chain, max_count=None):
+        """Headers of the best header chain not yet in `chain`, lowest first.
+
+        :param chain: the :class:`ethereum.chain.Chain` the bodies are
+                      imported to
+        """
+        head = self.head
+        number = min(chain.head.number, head.number)
+        while number > 0 and self.get_hash_by_number(number) not in chain:
+            number -= 1
+        end = head.number
+        if max_count is not None:
+            end = min(end, number + max_count)
+        return [self.get_header(self.get_hash_by_number(n))
+                for n in range(number + 1, end + 1)]
+
+    def import_body(self, chain, blockhash, transaction_list, uncles):
+        """Execute the body of a known header and add the block to `chain`.
+
+        :returns: the block if it was added, otherwise `None`
+        """
+        header = self.get_header(blockhash)
+        if header.prevhash not in chain:
+            log.debug('missing parent', header=header)
+            return None
+        parent = chain.get(header.prevhash)
+        try:
+            block = blocks.Block(header, transaction_list, uncles,
+                                 env=chain.env, parent=parent)
+        except (VerificationFailed, InvalidTransaction, ValueError) as e:
+            log.debug('invalid body', header=header, error=e)
+            return None
+        if chain.add_block(block):
+            return block
+        return None
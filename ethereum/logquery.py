@@ -0,0 +1,141 @@
+"""
+Search the logs of the longest chain.
+
+A query is answered in two steps:
+
+- the bit-sliced bloom index (see :meth:`ethereum.chain.Index.get_bloom_bits`)
+  gives the blocks of a section whose blooms match the filter, by combining
+  the vectors of the three bits of each value searched for
+- the stored receipts of these blocks are decoded and their logs compared
+  with the filter
+
+Blooms can give false positives only, so no matching log is missed.
+
+Blocks indexed before the bloom bits existed (see
+:meth:`ethereum.chain.Index.backfill_bloom_bits`) are checked one by one
+against the bloom in their header instead.
+"""
+from ethereum import blocks
+from ethereum import bloom
+from ethereum import utils
+from ethereum.utils import is_string
+
+
+class LogFilter(object):
+
+    """Criteria a log has to meet.
+
+    :param addresses: a list of addresses one of which must have emitted
+                      the log, or `None` for any address
+    :param topics: a list with an entry per topic position, each one a list
+                   of alternative topics or `None` for any topic. Topics
+                   are given as integers like :attr:`Log.topics` or as 32
+                   byte strings.
+    """
+
+    def __init__(self, addresses=None, topics=None):
+        self.addresses = None if addresses is None else set(addresses)
+        self.topics = []
+        for alternatives in topics or []:
+            if alternatives is not None:
+                alternatives = set(utils.big_endian_to_int(t) if is_string(t) else t
+                                   for t in alternatives)
+            self.topics.append(alternatives)
+        # per criterion a list of alternatives, each one the bloom bits of
+        # a value
+        self.bloom_bits = []
+        if self.addresses is not None:
+            self.bloom_bits.append([_bits(a) for a in self.addresses])
+        for alternatives in self.topics:
+            if alternatives is not None:
+                self.bloom_bits.append([_bits(utils.int32.serialize(t))
+                                        for t in alternatives])
+
+    def bloom_matches(self, value):
+        """`False` if no log included in the bloom `value` can match."""
+        return all(any(all(value >> bit & 1 for bit in bits) for bits in alternatives)
+                   for alternatives in self.bloom_bits)
+
+    def match_bloom_bits(self, get_vector, full):
+        """Apply the filter to many blooms at once.
+
+        :param get_vector: function returning the bit-sliced vector of a
+                           bloom bit
+        :param full: the vector of all blooms
+        :returns: the vector of the blooms that match
+        """
+        vectors = {}
+        candidates = full
+        for alternatives in self.bloom_bits:
+            matching = 0
+            for bits in alternatives:
+                vector = full
+                for bit in bits:
+                    if bit not in vectors:
+                        vectors[bit] = get_vector(bit)
+                    vector &= vectors[bit]
+                matching |= vector
+            candidates &= matching
+            if not candidates:
+                break
+        return candidates
+
+    def matches(self, log):
+        if self.addresses is not None and log.address not in self.addresses:
+            return False
+        if len(log.topics) < len(self.topics):
+            return False
+        for alternatives, topic in zip(self.topics, log.topics):
+            if alternatives is not None and topic not in alternatives:
+                return False
+        return True
+
+
+def get_logs(chain, log_filter, from_block=0, to_block=None):
+    """Find the logs of the longest chain that match a filter.
+
+    :param chain: the :class:`ethereum.chain.Chain` to search
+    :param log_filter: a :class:`LogFilter`
+    :param from_block: the number of the first block to search
+    :param to_block: the number of the last block to search, by default the
+                     head
+    :returns: a generator of tuples ``(log, block_number, blockhash,
+              tx_index, log_index)`` in the order of the chain
+    """
+    index = chain.index
+    head = chain.head.number
+    to_block = head if to_block is None else min(to_block, head)
+    size = index.bloom_section_size
+    number = from_block
+    # blocks without bloom bits
+    start = min(index.bloom_bits_start(), to_block + 1)
+    while number < start:
+        header = blocks.get_block_header(chain.db, index.get_block_by_number(number))
+        if log_filter.bloom_matches(header.bloom):
+            for result in _get_block_logs(chain, log_filter, number):
+                yield result
+        number += 1
+    while number <= to_block:
+        section = number // size
+        start = section * size
+        end = min(to_block, start + size - 1)
+        # the blocks from `number` to `end`
+        full = ((1 << (end - start + 1)) - 1) ^ ((1 << (number - start)) - 1)
+        candidates = log_filter.match_bloom_bits(
+            lambda bit: index.get_bloom_bits(section, bit), full)
+        for position in bloom.bits_in_number(candidates):
+            for result in _get_block_logs(chain, log_filter, start + position):
+                yield result
+        number = end + 1
+
+
+def _bits(value):
+    return [bits[0] for bits in bloom.bloom_bits(value)]
+
+
+def _get_block_logs(chain, log_filter, number):
+    blockhash = chain.index.get_block_by_number(number)
+    for tx_index, receipt in enumerate(chain.get_receipts(blockhash)):
+        for log_index, log in enumerate(receipt.logs):
+            if log_filter.matches(log):
+                yield log, number, blockhash, tx_index, log_index
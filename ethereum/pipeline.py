@@ -0,0 +1,235 @@
+"""
+Staged import of a sequence of blocks.
+
+Importing a block consists of four stages:
+
+- ``decode``: RLP decode header, transactions and uncles, without executing
+  anything
+- ``verify``: check the proof of work and the parts of the transactions
+  that do not depend on the state, including sender recovery (see
+  :func:`ethereum.processblock.prevalidate_transactions`)
+- ``execute``: build the :class:`ethereum.blocks.Block` on the state of its
+  parent, i.e. execute its transactions
+- ``persist``: add the block to the chain (:meth:`Chain.add_block`)
+
+:class:`ImportPipeline` runs decoding and verification of the following
+blocks in threads while the current block executes. The stages are
+connected by bounded queues, so a stage that gets ahead blocks until the
+next stage catches up. Executing and persisting mutate the chain and
+happen one block after another in the calling thread.
+"""
+import multiprocessing
+import threading
+import time
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+import rlp
+from ethereum import blocks
+from ethereum import processblock
+from ethereum.transactions import Transaction
+from ethereum.exceptions import InvalidTransaction, VerificationFailed
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.pipeline')
+
+STAGES = ('decode', 'verify', 'execute', 'persist')
+
+
+class StageMetrics(object):
+
+    """Timing of a pipeline stage.
+
+    :ivar count: number of blocks processed
+    :ivar failed: number of blocks rejected by the stage
+    :ivar busy: seconds spent processing blocks
+    :ivar blocked: seconds spent waiting for the next stage (backpressure)
+    :ivar max: longest time a single block took in seconds
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.failed = 0
+        self.busy = 0.
+        self.blocked = 0.
+        self.max = 0.
+
+    def add(self, elapsed, failed=False):
+        self.count += 1
+        self.failed += failed
+        self.busy += elapsed
+        self.max = max(self.max, elapsed)
+
+    @property
+    def mean(self):
+        return self.busy / self.count if self.count else 0.
+
+    def to_dict(self):
+        return dict(count=self.count, failed=self.failed, busy=self.busy,
+                    blocked=self.blocked, max=self.max, mean=self.mean)
+
+    def __repr__(self):
+        return '<StageMetrics(%s count=%d busy=%.3fs blocked=%.3fs)>' % \
+            (self.name, self.count, self.busy, self.blocked)
+
+
+class _Stop(Exception):
+    pass
+
+
+class ImportPipeline(object):
+
+    """Imports blocks into a chain in stages running concurrently.
+
+    :param chain: the :class:`ethereum.chain.Chain` to import to
+    :param queue_size: maximum number of blocks waiting between two stages
+    :param recovery_processes: number of worker processes the verify stage
+                               recovers the senders of large blocks in, by
+                               default none. The pool is created when
+                               :meth:`run` starts and terminated when it
+                               returns.
+    :ivar metrics: a dict of :class:`StageMetrics` by stage name
+    """
+
+    poll_interval = 0.1
+    _pool = None
+
+    def __init__(self, chain, queue_size=8, recovery_processes=0):
+        self.chain = chain
+        self.queue_size = queue_size
+        self.recovery_processes = recovery_processes
+        self.metrics = dict((name, StageMetrics(name)) for name in STAGES)
+
+    def _put(self, queue, item, metrics):
+        start = time.time()
+        while not self._stopped.is_set():
+            try:
+                queue.put(item, timeout=self.poll_interval)
+                metrics.blocked += time.time() - start
+                return
+            except Full:
+                pass
+        raise _Stop()
+
+    def _run_stage(self, name, process, source, queue):
+        metrics = self.metrics[name]
+        try:
+            for item in source:
+                if isinstance(item, BaseException):
+                    # raised by an earlier stage, pass it on
+                    self._put(queue, item, metrics)
+                    return
+                start = time.time()
+                try:
+                    item = process(item)
+                    failed = False
+                except (rlp.RLPException, InvalidTransaction, ValueError) as e:
+                    log.debug('block rejected', stage=name, error=e)
+                    item = None
+                    failed = True
+                metrics.add(time.time() - start, failed)
+                if item is not None:
+                    self._put(queue, item, metrics)
+            self._put(queue, None, metrics)
+        except _Stop:
+            pass
+        except Exception as e:
+            self._put(queue, e, metrics)
+
+    def _drain(self, queue):
+        while True:
+            try:
+                item = queue.get(timeout=self.poll_interval)
+            except Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            if item is None:
+                return
+            yield item
+
+    def decode(self, data):
+        """Decode an RLP encoded block into a tuple ``(header,
+        transactions, uncles)``."""
+        header, transaction_list, uncles = rlp.decode(data)
+        return (blocks.BlockHeader.deserialize(header),
+                [Transaction.deserialize(tx) for tx in transaction_list],
+                [blocks.BlockHeader.deserialize(u) for u in uncles])
+
+    def verify(self, decoded):
+        """Check the proof of work and the transactions of a decoded block."""
+        header, transaction_list, uncles = decoded
+        if header.number > 0 and not header.check_pow():
+            raise ValueError('PoW check failed')
+        processblock.prevalidate_transactions(header, transaction_list, self._pool)
+        return decoded
+
+    def execute(self, decoded):
+        """Build the block on the state of its parent.
+
+        :returns: the :class:`ethereum.blocks.Block` or `None` if its parent
+                  is not known
+        """
+        header, transaction_list, uncles = decoded
+        if header.prevhash not in self.chain:
+            log.debug('missing parent', block_hash=header)
+            return None
+        parent = self.chain.get(header.prevhash)
+        return blocks.Block(header, transaction_list, uncles,
+                            env=self.chain.env, parent=parent)
+
+    def run(self, rlp_blocks):
+        """Import RLP encoded blocks in the given order.
+
+        :param rlp_blocks: an iterable of RLP encoded blocks, consumed in a
+                           separate thread
+        :returns: the list of blocks added to the chain
+        """
+        self._stopped = threading.Event()
+        if self.recovery_processes > 1:
+            # forked before the stage threads are started
+            self._pool = multiprocessing.Pool(self.recovery_processes)
+        decoded = Queue(self.queue_size)
+        verified = Queue(self.queue_size)
+        threads = [threading.Thread(target=self._run_stage,
+                                    args=('decode', self.decode, rlp_blocks, decoded)),
+                   threading.Thread(target=self._run_stage,
+                                    args=('verify', self.verify, self._drain(decoded),
+                                          verified))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        added = []
+        execute, persist = self.metrics['execute'], self.metrics['persist']
+        try:
+            for item in self._drain(verified):
+                if isinstance(item, BaseException):
+                    raise item
+                start = time.time()
+                try:
+                    block = self.execute(item)
+                except (VerificationFailed, InvalidTransaction, ValueError) as e:
+                    log.debug('block rejected', stage='execute', error=e)
+                    block = None
+                execute.add(time.time() - start, block is None)
+                if block is None:
+                    continue
+                start = time.time()
+                ok = self.chain.add_block(block)
+                persist.add(time.time() - start, not ok)
+                if ok:
+                    added.append(block)
+        finally:
+            self._stopped.set()
+            for t in threads:
+                t.join()
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+        log.debug('imported', num=len(added),
+                  **dict((name, m.to_dict()) for name, m in self.metrics.items()))
+        return added
@@ -59,9 +59,17 @@ class Log(rlp.Serializable):
     def bloomables(self):
         return [self.address] + [utils.int32.serialize(x) for x in self.topics]
 
+    @property
+    def bloom(self):
+        """The bloom of the address and topics, hashed only once."""
+        b = self.__dict__.get('_bloom')
+        if b is None:
+            b = self.__dict__['_bloom'] = bloom.bloom_from_list(self.bloomables())
+        return b
+
     def to_dict(self):
         return {
-            "bloom": encode_hex(bloom.b64(bloom.bloom_from_list(self.bloomables()))),
+            "bloom": encode_hex(bloom.b64(self.bloom)),
             "address": encode_hex(self.address),
             "data": b'0x' + encode_hex(self.data),
             "topics": [encode_hex(utils.int32.serialize(t))
@@ -73,7 +81,8 @@ class Log(rlp.Serializable):
             (encode_hex(self.address), self.topics, self.data)
 
 
-def validate_transaction(block, tx):
+def validate_transaction_stateless(block, tx):
+    """Check the parts of a transaction that do not depend on the state."""
 
     def rp(what, actual, target):
         return '%r: %r actual:%r target:%r' % (tx, what, actual, target)
@@ -84,17 +93,47 @@ def validate_transaction(block, tx):
     if block.number >= config.default_config["HOMESTEAD_FORK_BLKNUM"]:
             tx.check_low_s()
 
+    # (3) the gas limit is no smaller than the intrinsic gas,
+    # g0, used by the transaction;
+    if tx.startgas < tx.intrinsic_gas_used:
+        raise InsufficientStartGas(rp('startgas', tx.startgas, tx.intrinsic_gas_used))
+
+
+def prevalidate_transactions(block, txs, pool=None):
+    """Run the stateless checks of all transactions of `block` up front.
+
+    The senders are recovered at once (see
+    :func:`ethereum.transactions.recover_senders`). Transactions that pass
+    are marked, so that :func:`validate_transaction` only does the state
+    dependent checks when they are applied.
+
+    :param block: the block or just its header
+    :param pool: an optional `multiprocessing.Pool` to recover the senders
+                 in
+    :raises: :exc:`InvalidTransaction` for the first invalid transaction
+    """
+    transactions.recover_senders(txs, pool)
+    homestead = block.number >= config.default_config["HOMESTEAD_FORK_BLKNUM"]
+    for tx in txs:
+        if tx._prevalidated != homestead:
+            validate_transaction_stateless(block, tx)
+            tx._prevalidated = homestead
+
+
+def validate_transaction(block, tx):
+
+    def rp(what, actual, target):
+        return '%r: %r actual:%r target:%r' % (tx, what, actual, target)
+
+    if tx._prevalidated != (block.number >= config.default_config["HOMESTEAD_FORK_BLKNUM"]):
+        validate_transaction_stateless(block, tx)
+
     # (2) the transaction nonce is valid (equivalent to the
     #     sender account's current nonce);
     acctnonce = block.get_nonce(tx.sender)
     if acctnonce != tx.nonce:
         raise InvalidNonce(rp('nonce', tx.nonce, acctnonce))
 
-    # (3) the gas limit is no smaller than the intrinsic gas,
-    # g0, used by the transaction;
-    if tx.startgas < tx.intrinsic_gas_used:
-        raise InsufficientStartGas(rp('startgas', tx.startgas, tx.intrinsic_gas_used))
-
     # (4) the sender account balance contains at least the
     # cost, v0, required in up-front payment.
     total_cost = tx.value + tx.gasprice * tx.startgas
@@ -108,10 +147,28 @@ def validate_transaction(block, tx):
     return True
 
 
-def apply_transaction(block, tx):
+def apply_transaction(block, tx, tracer=None):
     validate_transaction(block, tx)
+    success, output = execute_transaction(block, tx, tracer)
+    commit_transaction(block, tx)
+    return success, output
 
-    # print block.get_nonce(tx.sender), '@@@'
+
+def _pay_coinbase(block, value):
+    # fees only ever add to the coinbase balance, so the speculative
+    # executor (see `ethereum.speculation`) does not count this as a read
+    recorder, block.access_recorder = block.access_recorder, None
+    block.delta_balance(block.coinbase, value)
+    block.access_recorder = recorder
+
+
+def execute_transaction(block, tx, tracer=None):
+    """Execute a validated transaction without committing the state.
+
+    The changes are left in the account caches and the journal of `block`,
+    the suicides and logs in `block.suicides` and `block.logs`, until
+    :func:`commit_transaction` is called.
+    """
 
     def rp(what, actual, target):
         return '%r: %r actual:%r target:%r' % (tx, what, actual, target)
@@ -136,7 +193,7 @@ def apply_transaction(block, tx):
     message = vm.Message(tx.sender, tx.to, tx.value, message_gas, message_data, code_address=tx.to)
 
     # MESSAGE
-    ext = VMExt(block, tx)
+    ext = VMExt(block, tx, tracer)
     if tx.to and tx.to != CREATE_CONTRACT_ADDRESS:
         result, gas_remained, data = apply_msg(ext, message)
         log_tx.debug('_res_', result=result, gas_remained=gas_remained, data=data)
@@ -154,7 +211,7 @@ def apply_transaction(block, tx):
         log_tx.debug('TX FAILED', reason='out of gas',
                      startgas=tx.startgas, gas_remained=gas_remained)
         block.gas_used += tx.startgas
-        block.delta_balance(block.coinbase, tx.gasprice * tx.startgas)
+        _pay_coinbase(block, tx.gasprice * tx.startgas)
         output = b''
         success = 0
     else:
@@ -168,13 +225,19 @@ def apply_transaction(block, tx):
             block.refunds = 0
         # sell remaining gas
         block.delta_balance(tx.sender, tx.gasprice * gas_remained)
-        block.delta_balance(block.coinbase, tx.gasprice * gas_used)
+        _pay_coinbase(block, tx.gasprice * gas_used)
         block.gas_used += gas_used
         if tx.to:
             output = b''.join(map(ascii_chr, data))
         else:
             output = data
         success = 1
+    return success, output
+
+
+def commit_transaction(block, tx):
+    """Commit the state changes of an executed transaction and add it to
+    the transaction list of `block`."""
     block.commit_state()
     suicides = block.suicides
     block.suicides = []
@@ -184,7 +247,6 @@ def apply_transaction(block, tx):
         block.del_account(s)
     block.add_transaction_to_list(tx)
     block.logs = []
-    return success, output
 
 
 # External calls that can be made from inside the VM. To use the EVM with a
@@ -192,8 +254,9 @@ def apply_transaction(block, tx):
 # swap out the functions here
 class VMExt():
 
-    def __init__(self, block, tx):
+    def __init__(self, block, tx, tracer=None):
         self._block = block
+        self.tracer = tracer
         self.get_code = block.get_code
         self.get_balance = block.get_balance
         self.set_balance = block.set_balance
@@ -238,12 +301,17 @@ def _apply_msg(ext, msg, code):
                             bal=ext.get_balance(msg.to),
                             state=ext.log_storage(msg.to))
         # log_state.trace('CODE', code=code)
+    tracer = ext.tracer
+    if tracer:
+        tracer.enter_call(msg)
     # Transfer value, instaquit if not enough
     snapshot = ext._block.snapshot()
     if msg.transfers_value:
         if not ext._block.transfer_value(msg.sender, msg.to, msg.value):
             log_msg.debug('MSG TRANSFER FAILED', have=ext.get_balance(msg.to),
                           want=msg.value)
+            if tracer:
+                tracer.exit_call(msg, 1, msg.gas, [])
             return 1, msg.gas, []
     # Main loop
     if msg.code_address in specials.specials:
@@ -267,6 +335,8 @@ def _apply_msg(ext, msg, code):
         log_msg.debug('REVERTING')
         ext._block.revert(snapshot)
 
+    if tracer:
+        tracer.exit_call(msg, res, gas, dat)
     return res, gas, dat
 
 
@@ -927,6 +927,53 @@ class Trie(object):
             to_string(value))
         self.replace_root_hash(old_root, self.root_node)
 
+    def update_all(self, items):
+        '''
+        :param items: a list of (key, value) strings
+
+        If the trie is blank, it is built bottom up and every node is
+        encoded and stored once, instead of storing and deleting the
+        intermediate nodes of updating the keys one after another.
+        '''
+        if self.root_node != BLANK_NODE:
+            for key, value in items:
+                self.update(key, value)
+            return
+        items = dict((to_string(k), to_string(v)) for k, v in items)
+        if not items:
+            return
+        nibbles = sorted((bin_to_nibbles(k), v) for k, v in items.items())
+        root = self._build(nibbles, 0)
+        # stored as a node and as the root, like by `update`
+        self._encode_node(root)
+        self.replace_root_hash(BLANK_NODE, root)
+
+    def _build(self, items, depth):
+        # items: sorted (nibbles, value) sharing the first `depth` nibbles
+        if len(items) == 1:
+            key, value = items[0]
+            return [pack_nibbles(with_terminator(key[depth:])), value]
+        first, last = items[0][0], items[-1][0]
+        end = depth
+        while end < min(len(first), len(last)) and first[end] == last[end]:
+            end += 1
+        if end > depth:
+            child = self._build(items, end)
+            return [pack_nibbles(first[depth:end]), self._encode_node(child)]
+        node = [BLANK_NODE] * 17
+        start = 0
+        if len(first) == depth:
+            node[16] = items[0][1]
+            start = 1
+        while start < len(items):
+            nibble = items[start][0][depth]
+            stop = start
+            while stop < len(items) and items[stop][0][depth] == nibble:
+                stop += 1
+            node[nibble] = self._encode_node(self._build(items[start:stop], depth + 1))
+            start = stop
+        return node
+
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
             return True
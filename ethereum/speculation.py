@@ -0,0 +1,149 @@
+"""
+Speculative parallel execution of the transactions of a block.
+
+All transactions are first executed speculatively, each one on its own on
+the state the block has before any of them is applied. Meanwhile the
+account items and storage slots they read are recorded (see
+`Block.access_recorder`) and the values they write are taken from the
+journal. Then the transactions are committed in block order: if none of
+the items a transaction read has been written by a transaction committed
+before it, its recorded writes are replayed, otherwise it is executed
+again on the actual state. The resulting state, receipts and logs are
+identical to those of applying the transactions one after another.
+
+Transaction fees are added to the coinbase balance as a delta, so paying
+them does not make all transactions of a block conflict with each other.
+
+The speculative executions run in a pool of processes forked for that
+purpose, so that they share the state of the block as it is at that point.
+"""
+import multiprocessing
+import os
+
+from ethereum import processblock
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.speculation')
+
+# speculate in worker processes from this many transactions on
+PARALLEL_SPECULATION_MIN_TXS = 16
+
+# account items an account's deletion writes
+_ACCOUNT_ITEMS = ('all', 'balance', 'nonce', 'code', 'storage')
+
+
+def speculate(block, tx):
+    """Execute `tx` on the current state of `block` and undo it again.
+
+    :returns: `None` if the transaction could not be executed, otherwise a
+              tuple ``(reads, writes, coinbase_delta, gas_used, logs,
+              suicides, result)``, where `writes` is a list of
+              ``(cache, index, value)`` in the order of the journal and
+              `result` is the return value of
+              :func:`ethereum.processblock.apply_transaction`
+    """
+    assert not block.journal
+    coinbase_balance = block.get_balance(block.coinbase)
+    gas_used = block.gas_used
+    snapshot = block.snapshot()
+    listeners, block.log_listeners = block.log_listeners, []
+    reads = block.access_recorder = set()
+    try:
+        processblock.validate_transaction(block, tx)
+        result = processblock.execute_transaction(block, tx)
+        block.access_recorder = None
+        writes = [(cache, index, value)
+                  for cache, index, _, value in block.journal]
+        return (reads, writes,
+                block.get_balance(block.coinbase) - coinbase_balance,
+                block.gas_used - gas_used,
+                [(l.address, l.topics, l.data) for l in block.logs],
+                list(block.suicides), result)
+    except Exception as e:
+        # whatever went wrong on this state, the transaction is executed
+        # again in order, which reproduces the error if there is one
+        log.debug('speculation failed', tx=tx, error=e)
+        return None
+    finally:
+        block.access_recorder = None
+        block.log_listeners = listeners
+        block.revert(snapshot)
+        # drop the values read, so that the next speculation records
+        # all its reads and journals all its writes
+        block.reset_cache()
+
+
+_speculation = None  # (block, txs) shared with the forked workers
+
+
+def _speculate_index(i):
+    block, txs = _speculation
+    return speculate(block, txs[i])
+
+
+def _speculate_all(block, txs, processes):
+    global _speculation
+    if processes > 1 and len(txs) >= PARALLEL_SPECULATION_MIN_TXS \
+            and hasattr(os, 'fork'):
+        _speculation = (block, txs)
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_speculate_index, range(len(txs)))
+        finally:
+            pool.terminate()
+            _speculation = None
+    return [speculate(block, tx) for tx in txs]
+
+
+def _replay(block, speculation):
+    _, writes, coinbase_delta, gas_used, logs, suicides, result = speculation
+    coinbase = block.coinbase
+    for cache, index, value in writes:
+        if cache == 'balance' and index == coinbase:
+            continue
+        if cache not in block.caches:
+            block.caches[cache] = {}
+        block.set_and_journal(cache, index, value)
+    if coinbase_delta:
+        block.delta_balance(coinbase, coinbase_delta)
+    block.gas_used += gas_used
+    for address, topics, data in logs:
+        block.add_log(processblock.Log(address, topics, data))
+    block.suicides.extend(suicides)
+    return result
+
+
+def apply_transactions(block, txs, processes=None):
+    """Apply transactions to a block like repeated calls of
+    :func:`ethereum.processblock.apply_transaction`.
+
+    :param processes: number of processes to speculate in, by default the
+                      number of CPUs
+    :returns: the list of the ``(success, output)`` tuples of the
+              transactions
+    :raises: :exc:`ethereum.exceptions.InvalidTransaction` for the first
+             invalid transaction, after the ones before were applied
+    """
+    if block.journal:
+        block.commit_state()
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    speculations = _speculate_all(block, txs, processes)
+    written = set()
+    results = []
+    reexecuted = 0
+    for tx, speculation in zip(txs, speculations):
+        processblock.validate_transaction(block, tx)
+        if speculation is None or not written.isdisjoint(speculation[0]):
+            reexecuted += 1
+            result = processblock.execute_transaction(block, tx)
+        else:
+            result = _replay(block, speculation)
+        for cache, index, _, _ in block.journal:
+            written.add((cache, index))
+        for address in block.suicides:
+            written.update((item, address) for item in _ACCOUNT_ITEMS)
+        processblock.commit_transaction(block, tx)
+        results.append(result)
+    log.debug('applied speculatively', num_txs=len(txs), reexecuted=reexecuted)
+    return results
@@ -0,0 +1,80 @@
+import random
+import pytest
+from ethereum import arith
+from ethereum.utils import to_signed, encode_int
+
+TT256 = 2 ** 256
+TT256M1 = 2 ** 256 - 1
+
+edges = [0, 1, 2, 3, 31, 32, 255, 256, 2 ** 64, 2 ** 128 - 1, 2 ** 128,
+         2 ** 255 - 1, 2 ** 255, 2 ** 255 + 1, TT256 - 2, TT256M1]
+
+
+def words():
+    rnd = random.Random(4)
+    return edges + [rnd.randrange(2 ** rnd.choice([8, 64, 128, 255, 256]))
+                    for i in range(40)]
+
+
+# the plain big number definitions the fast paths must agree with
+def ref_sdiv(s0, s1):
+    s0, s1 = to_signed(s0), to_signed(s1)
+    return 0 if s1 == 0 else (abs(s0) // abs(s1) * (-1 if s0 * s1 < 0 else 1)) & TT256M1
+
+
+def ref_smod(s0, s1):
+    s0, s1 = to_signed(s0), to_signed(s1)
+    return 0 if s1 == 0 else (abs(s0) % abs(s1) * (-1 if s0 < 0 else 1)) & TT256M1
+
+
+def ref_signextend(s0, s1):
+    if s0 <= 31:
+        testbit = s0 * 8 + 7
+        if s1 & (1 << testbit):
+            return s1 | (TT256 - (1 << testbit))
+        return s1 & ((1 << testbit) - 1)
+    return s1
+
+
+binary = [
+    (arith.add, lambda a, b: (a + b) & TT256M1),
+    (arith.sub, lambda a, b: (a - b) & TT256M1),
+    (arith.mul, lambda a, b: (a * b) & TT256M1),
+    (arith.div, lambda a, b: 0 if b == 0 else a // b),
+    (arith.mod, lambda a, b: 0 if b == 0 else a % b),
+    (arith.sdiv, ref_sdiv),
+    (arith.smod, ref_smod),
+    (arith.exp, lambda a, b: pow(a, b, TT256)),
+]
+
+
+@pytest.mark.parametrize('f,ref', binary, ids=[f.__name__ for f, _ in binary])
+def test_binary(f, ref):
+    for a in words():
+        for b in words():
+            assert f(a, b) == ref(a, b), (a, b)
+
+
+def test_exp_small_exponents():
+    for base in words():
+        for e in range(300):
+            assert arith.exp(base, e) == pow(base, e, TT256), (base, e)
+
+
+def test_modular():
+    for a in words():
+        for b in words():
+            for m in (0, 1, 7, 2 ** 255, TT256M1):
+                assert arith.addmod(a, b, m) == (0 if m == 0 else (a + b) % m)
+                assert arith.mulmod(a, b, m) == (0 if m == 0 else (a * b) % m)
+
+
+def test_signextend():
+    for b in list(range(34)) + [TT256M1]:
+        for x in words():
+            assert arith.signextend(b, x) == ref_signextend(b, x), (b, x)
+
+
+def test_exp_bytes():
+    for x in words():
+        assert arith.exp_bytes(x) == len(encode_int(x))
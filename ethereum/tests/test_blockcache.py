@@ -0,0 +1,72 @@
+from ethereum import blocks
+from ethereum.blockcache import BlockCache
+from ethereum.db import EphemDB
+from ethereum.config import Env
+from ethereum.tests.test_chain import mkquickgenesis, mine_next_block, accounts
+
+
+class Header(object):
+
+    def __init__(self, hash):
+        self.hash = hash
+
+
+def test_eviction_by_size():
+    cache = BlockCache(max_header_bytes=100)
+    db = object()
+    for i in range(4):
+        cache.put_header(db, Header(i), 30)
+    assert cache.get_header(db, 0) is None
+    assert [cache.get_header(db, i).hash for i in range(1, 4)] == [1, 2, 3]
+    assert cache.headers.size == 90
+    stats = cache.stats()['headers']
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3 and stats['misses'] == 1
+    # too large to be cached at all
+    cache.put_header(db, Header(4), 101)
+    assert cache.get_header(db, 4) is None
+    assert cache.headers.size == 90
+
+
+def test_recently_used_stay():
+    cache = BlockCache(max_block_bytes=100)
+    env = object()
+    for i in range(3):
+        cache.put_block(env, Header(i), 30)
+    assert cache.get_block(env, 0) is not None
+    cache.put_block(env, Header(3), 30)
+    assert cache.get_block(env, 0) is not None
+    assert cache.get_block(env, 1) is None
+
+
+def test_invalidate():
+    cache = BlockCache()
+    db, db2 = object(), object()
+    for owner in (db, db2):
+        cache.put_header(owner, Header(b'a'), 10)
+        cache.put_header(owner, Header(b'b'), 10)
+        cache.put_block(owner, Header(b'a'), 10)
+    cache.invalidate([b'a'])
+    assert cache.get_header(db, b'a') is None
+    assert cache.get_header(db2, b'a') is None
+    assert cache.get_block(db, b'a') is None
+    assert cache.get_header(db, b'b') is not None
+    assert cache.headers.size == 20 and cache.blocks.size == 0
+
+
+def test_get_block_cached():
+    k, v, k2, v2 = accounts()
+    db = EphemDB()
+    env = Env(db)
+    blk = mkquickgenesis({v: {"balance": 10 ** 18}}, db=db)
+    blk2 = mine_next_block(blk)
+    blocks.store_block(db, blk2)
+    loaded = blocks.get_block(env, blk2.hash)
+    assert loaded == blk2
+    assert blocks.get_block(env, blk2.hash) is loaded
+    header = blocks.get_block_header(db, blk2.hash)
+    assert header == blk2.header
+    assert blocks.get_block_header(db, blk2.hash) is header
+    blocks.block_cache.invalidate([blk2.hash])
+    assert blocks.get_block(env, blk2.hash) is not loaded
+    assert blocks.get_block_header(db, blk2.hash) is not header
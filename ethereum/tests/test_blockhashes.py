@@ -17,3 +17,7 @@ def test_blockhashes_300():
     assert o[0] == s.block.get_parent().hash == s.blocks[299].hash
     for i in range(1, 256):
         assert o[i] == s.blocks[299 - i].hash
+    # only the last 256 hashes are passed on, older ones come from the headers
+    assert len(s.block.ancestor_hashes) == 256
+    assert s.block.get_ancestor_hash(300) == s.blocks[0].hash
+    assert s.block.get_ancestor_hash(301) is None
@@ -5,9 +5,11 @@ import ethereum.transactions as transactions
 import rlp
 from rlp.utils import decode_hex, encode_hex
 import ethereum.ethpow as ethpow
+import ethereum.trie as trie
 import ethereum.utils as utils
-from ethereum.chain import Chain
+from ethereum.chain import Chain, Index
 from ethereum.db import EphemDB
+from ethereum.refcount_db import RefcountDB
 from ethereum.tests.utils import new_db
 
 from ethereum.slogging import get_logger
@@ -22,6 +24,14 @@ def db():
 alt_db = db
 
 
+@pytest.fixture(params=['ephem', 'refcount'])
+def index_db(request):
+    "databases the chain indexes are tested on"
+    if request.param == 'refcount':
+        return RefcountDB(EphemDB())
+    return EphemDB()
+
+
 def env(db):
     return blocks.Env(db)
 
@@ -139,6 +149,71 @@ def test_failing_transfer(db):
     assert blk.get_balance(v2) == b_v2
 
 
+def test_snapshot_revert(db):
+    k, v, k2, v2 = accounts()
+    blk = blocks.genesis(env(db), start_alloc={v: {"balance": 100}})
+    root = blk.state_root
+    outer = blk.snapshot()
+    blk.transfer_value(v, v2, 10)
+    blk.commit_state()
+    committed_root = blk.state_root
+    inner = blk.snapshot()
+    blk.transfer_value(v, v2, 20)
+    blk.set_storage_data(v2, 1, 2)
+    blk.refunds += 5
+    # nothing committed since the inner snapshot, the root stays as is
+    blk.revert(inner)
+    assert blk.get_balance(v2) == 10
+    assert blk.get_storage_data(v2, 1) == 0
+    assert blk.refunds == 0
+    assert blk.state_root == committed_root
+    # across a commit the state root is restored
+    blk.del_account(v2)
+    assert blk.state_root != committed_root
+    blk.revert(inner)
+    assert blk.state_root == committed_root
+    assert blk.get_balance(v2) == 10
+    blk.revert(outer)
+    assert blk.state_root == root
+    assert blk.get_balance(v) == 100
+    assert blk.get_balance(v2) == 0
+
+
+def test_header_hash_memoized(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    header = rlp.decode(rlp.encode(blk.header), blocks.BlockHeader)
+    assert header.hash == blk.hash
+    assert header.hash is header.hash
+    mining_hash = header.mining_hash
+    header._mutable = True
+    header._cached_rlp = None
+    header.nonce = b'\x01' * 8
+    assert header.mining_hash is mining_hash
+    assert header.hash == utils.sha3(rlp.encode(header)) != blk.hash
+    header.gas_limit += 1
+    assert header.mining_hash != mining_hash
+    # the hash of a block is memoized too and follows its trie roots
+    blk2 = blocks.Block.init_from_parent(blk, v)
+    h = blk2.hash
+    assert blk2.hash is h
+    snapshot = blk2.snapshot()
+    blk2.delta_balance(v, 1)
+    h2 = blk2.hash
+    assert h2 != h
+    assert blk2.hash is h2
+    blk2.revert(snapshot)
+    assert blk2.hash == h
+    success, _ = processblock.apply_transaction(blk2, get_transaction())
+    assert success
+    h3 = blk2.hash
+    assert h3 != h
+    assert blk2.hash is h3
+    blk2.state_root = blk.state_root
+    assert blk2.hash != h3
+    assert blk2.hash == utils.sha3(rlp.encode(blk2.header))
+
+
 def test_serialize_block(db):
     blk = blocks.genesis(env(db))
     tb_blk = blocks.BlockHeader.from_block_rlp(rlp.encode(blk))
@@ -342,6 +417,83 @@ def test_transaction(db):
     assert blk.get_balance(v2) == utils.denoms.finney * 10
 
 
+def test_pending_transactions(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(db), genesis=blk)
+    tx1 = get_transaction(nonce=1)
+    assert chain.add_transaction(tx1) is False
+    assert tx1.hash in chain.transaction_pool
+    assert chain.get_transactions() == []
+    # filling the gap makes the queued tx executable as well
+    tx0 = get_transaction(nonce=0)
+    assert chain.add_transaction(tx0)
+    assert chain.get_transactions() == [tx0, tx1]
+    assert chain.add_transaction(tx0) is None
+    # a better priced tx with the same nonce replaces the included one
+    tx1b = get_transaction(gasprice=10, nonce=1)
+    assert chain.add_transaction(tx1b)
+    assert chain.get_transactions() == [tx0, tx1b]
+    # mined transactions leave the pool
+    tx2 = get_transaction(nonce=2)
+    assert chain.add_transaction(tx2)
+    assert len(chain.transaction_pool) == 3
+    blk = mine_on_chain(chain)
+    assert blk.get_transactions() == [tx0, tx1b, tx2]
+    assert len(chain.transaction_pool) == 0
+    assert chain.get_transactions() == []
+
+
+def test_head_candidate_finalized_lazily(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    coinbase = b'\x42' * 20
+    chain = Chain(env=env(db), genesis=blk, coinbase=coinbase)
+    reward = chain.env.config['BLOCK_REWARD']
+    for nonce in range(3):
+        assert chain.add_transaction(get_transaction(gasprice=1, nonce=nonce))
+        assert not chain._head_candidate_finalized
+    head_candidate = chain.head_candidate
+    assert chain._head_candidate_finalized
+    assert head_candidate.get_balance(coinbase) == reward + head_candidate.gas_used
+    assert head_candidate.ether_delta == reward
+    assert chain.head_candidate is head_candidate
+    assert head_candidate.get_balance(coinbase) == reward + head_candidate.gas_used
+
+
+def test_head_candidate_held_across_add_transaction(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    coinbase = b'\x42' * 20
+    chain = Chain(env=env(db), genesis=blk, coinbase=coinbase)
+    reward = chain.env.config['BLOCK_REWARD']
+    head_candidate = chain.head_candidate
+    assert head_candidate.get_balance(coinbase) == reward
+    for nonce in range(2):
+        assert chain.add_transaction(get_transaction(gasprice=1, nonce=nonce))
+        # the block handed out is finalized again, with the transaction
+        assert head_candidate.transaction_count == nonce + 1
+        assert head_candidate.get_balance(coinbase) == reward + head_candidate.gas_used
+        assert head_candidate.ether_delta == reward
+        state_root = head_candidate.state_root
+        assert chain.head_candidate is head_candidate
+        assert head_candidate.state_root == state_root
+    # an invalid transaction leaves it unchanged
+    tx = transactions.Transaction(2, 1, 100000, v2, utils.denoms.ether * 2, b'').sign(k)
+    assert chain.add_transaction(tx) is False
+    assert head_candidate.state_root == state_root
+    assert head_candidate.ether_delta == reward
+    # and it can be mined
+    m = ethpow.Miner(head_candidate)
+    nonce = 0
+    b = None
+    while not b:
+        b = m.mine(rounds=100, start_nonce=nonce)
+        nonce += 100
+    assert chain.add_block(b)
+    assert chain.head.get_balance(coinbase) == reward + b.gas_used
+
+
 def test_transaction_serialization():
     k, v, k2, v2 = accounts()
     tx = get_transaction()
@@ -428,6 +580,246 @@ def test_simple_chain(db):
     assert chain.index.get_transaction(tx.hash) == (tx, blk2, 0)
 
 
+def test_add_block_executes_once(db, alt_db, monkeypatch):
+    k, v, k2, v2 = accounts()
+    remote = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    blk = mine_next_block(remote, transactions=[get_transaction()])
+    local = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=alt_db)
+    chain = Chain(env=env(local.db), genesis=local)
+    received = blocks.Block.deserialize(rlp.decode(rlp.encode(blk)), env=chain.env)
+    assert received.get_parent() == local
+
+    def fail(*args):
+        raise AssertionError('block executed again')
+    monkeypatch.setattr(processblock, 'verify', fail)
+    monkeypatch.setattr(processblock, 'apply_transaction', fail)
+    assert chain.add_block(received)
+    assert chain.head == blk
+
+    # the header is still checked against the parent
+    monkeypatch.undo()
+    parent = chain.head
+    bad = blocks.Block.init_from_parent(parent, v, timestamp=parent.timestamp + 1, env=chain.env)
+    bad.header.difficulty = 2
+    bad.finalize()
+    bad = ethpow.Miner(bad).mine(rounds=1000, start_nonce=0)
+    with pytest.raises(ValueError) as e:
+        chain.add_block(bad)
+    assert 'difficulty' in str(e.value)
+
+
+def test_block_records(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    tx = get_transaction()
+    blk2 = mine_next_block(blk, transactions=[tx])
+    assert chain.add_block(blk2)
+    # header, body and receipts are stored apart, not as a single blob
+    assert blk2.hash not in db
+    assert blocks.has_block(db, blk2.hash)
+    assert blocks.get_block_header(db, blk2.hash) == blk2.header
+    assert chain.get_bloom(blk2.hash) == blk2.bloom
+    receipts = chain.get_receipts(blk2.hash)
+    assert len(receipts) == 1
+    assert receipts[0].gas_used == blk2.gas_used
+    assert chain.get(blk2.hash) == blk2
+    assert chain.get(blk2.hash).get_transactions() == [tx]
+    assert chain.index.get_transaction(tx.hash)[0] == tx
+    with pytest.raises(KeyError):
+        chain.get_receipts(b'\x00' * 32)
+    # blocks stored as a blob can still be read
+    blk3 = mine_next_block(blk2)
+    db.put(blk3.hash, rlp.encode(blk3))
+    assert blocks.has_block(db, blk3.hash)
+    assert blocks.get_block_header(db, blk3.hash) == blk3.header
+    assert blocks.get_block(chain.env, blk3.hash) == blk3
+
+
+def test_get_block_lazy(db, monkeypatch):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    tx = get_transaction()
+    blk2 = mine_next_block(blk, transactions=[tx])
+    assert chain.add_block(blk2)
+    blk3 = mine_next_block(blk2)
+    assert chain.add_block(blk3)
+
+    def fail(*args):
+        raise AssertionError('transaction trie built')
+    monkeypatch.setattr(trie.Trie, 'update', fail)
+    chain = Chain(env=env(db))  # not cached yet
+    # loading blocks and walking parents does not build the transaction trie
+    assert [b.hash for b in chain.get_chain(count=3)] == [blk3.hash, blk2.hash, blk.hash]
+    loaded = chain.get(blk2.hash)
+    assert loaded.tx_list_root == blk2.tx_list_root
+    assert loaded.get_transactions() == [tx]
+    assert loaded.get_transaction(0) == tx
+    with pytest.raises(IndexError):
+        loaded.get_transaction(1)
+    assert rlp.encode(loaded) == rlp.encode(blk2)
+    # the trie is built when it is needed
+    monkeypatch.undo()
+    assert loaded.transactions.root_hash == blk2.tx_list_root
+    assert loaded.get_transaction(0) == tx
+
+
+def test_chain_difficulty_index(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    blk2 = mine_next_block(blk)
+    assert chain.add_block(blk2)
+    key = b'difficulty:' + encode_hex(blk2.hash)
+    assert utils.decode_int(db.get(key)) == blk.difficulty + blk2.difficulty
+    assert blk2.chain_difficulty() == blk.difficulty + blk2.difficulty
+
+
+def test_chain_difficulty_iterative(db):
+    # more ancestors than the recursion limit, none of them indexed
+    header = blocks.BlockHeader(difficulty=1, number=0)
+    db.put(b'blockheader:' + header.hash, rlp.encode(header))
+    for i in range(1, 3000):
+        header = blocks.BlockHeader(prevhash=header.hash, number=i, difficulty=i + 1)
+        db.put(b'blockheader:' + header.hash, rlp.encode(header))
+    assert blocks.get_chain_difficulty(db, header) == 3000 * 3001 // 2
+    # an indexed ancestor ends the walk
+    assert blocks.store_chain_difficulty(db, header) == 3000 * 3001 // 2
+    child = blocks.BlockHeader(prevhash=header.hash, number=3000, difficulty=5)
+    assert blocks.get_chain_difficulty(db, child) == 3000 * 3001 // 2 + 5
+    orphan = blocks.BlockHeader(prevhash=b'\x01' * 32, number=5)
+    with pytest.raises(KeyError):
+        blocks.get_chain_difficulty(db, orphan)
+
+
+def test_blocknumbers_without_max_record(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    blk2 = mine_on_chain(chain)
+    mine_on_chain(chain)
+    # as indexed before the number of the head was recorded
+    db.delete(b'blocknumber:max')
+    index = Index(chain.env)
+    assert index.has_block_by_number(2)
+    assert not index.has_block_by_number(3)
+    # the record is written by the first scan
+    assert utils.decode_int(db.get(b'blocknumber:max')) == 2
+    index.update_blocknumbers(blk2)
+    assert not index.has_block_by_number(2)
+
+
+def test_blocknumbers_shorter_head(index_db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=index_db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    blk2 = mine_next_block(blk)
+    assert chain.add_block(blk2)
+    blk3 = mine_next_block(blk2)
+    assert chain.add_block(blk3)
+    blk4 = mine_next_block(blk3)
+    assert chain.add_block(blk4)
+    assert chain.index.get_block_by_number(2) == blk3.hash
+    for i in range(2):
+        chain.index.update_blocknumbers(blk2)
+        assert chain.index.get_block_by_number(1) == blk2.hash
+        assert not chain.index.has_block_by_number(2)
+        with pytest.raises(KeyError):
+            chain.index.get_block_by_number(3)
+        assert not chain.in_main_branch(blk3)
+    # the stale numbers are overwritten
+    chain.index.update_blocknumbers(blk3)
+    assert chain.in_main_branch(blk3)
+    assert not chain.index.has_block_by_number(3)
+
+
+def test_children_index(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    children = [b'\x01' * 32, b'\x02' * 32, b'\x03' * 32]
+    for c in children + children[:1]:
+        chain.index.add_child(blk.hash, c)
+    assert chain.index.get_children(blk.hash) == children
+    # lists written by earlier versions are still read
+    other = b'\x04' * 32
+    others = [b'\x05' * 32, b'\x06' * 32, b'\x07' * 32]
+    db.put(b'ci:' + other, rlp.encode(others[:2]))
+    chain.index.add_child(other, others[1])
+    chain.index.add_child(other, others[2])
+    assert chain.index.get_children(other) == others
+
+
+def test_uncle_candidates(db):
+    blk0 = mkquickgenesis(db=db)
+    chain = Chain(env=env(blk0.db), genesis=blk0)
+    uncle = mine_on_chain(chain, blk0, coinbase=decode_hex('2' * 40))
+    blk1 = mine_on_chain(chain, blk0, coinbase=decode_hex('1' * 40))
+    assert chain.get_uncle_candidates(blk1) == [uncle.header]
+    assert chain.get_brothers(blk1) == [uncle]
+    assert chain.head_candidate.uncles == [uncle.header]
+
+
+def test_transaction_index_reorg(db):
+    k, v, k2, v2 = accounts()
+    blk0 = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk0.db), genesis=blk0)
+    tx = get_transaction()
+    assert chain.add_transaction(tx)
+    a1 = mine_on_chain(chain, blk0)
+    assert chain.index.get_transaction(tx.hash) == (tx, a1, 0)
+    assert blocks.get_block_transaction_hashes(db, a1.hash) == [tx.hash]
+    # the transaction is not part of the new longest chain
+    b1 = mine_on_chain(chain, blk0, coinbase=decode_hex('2' * 40))
+    b2 = mine_on_chain(chain, b1)
+    assert chain.head == b2
+    with pytest.raises(KeyError):
+        chain.index.get_transaction(tx.hash)
+    # back to the old branch
+    chain._update_head(a1)
+    assert chain.index.get_transaction(tx.hash) == (tx, a1, 0)
+    assert not chain.index.has_block_by_number(2)
+
+
+def test_transaction_index_rollback(index_db):
+    k, v, k2, v2 = accounts()
+    blk0 = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=index_db)
+    chain = Chain(env=env(blk0.db), genesis=blk0)
+    tx = get_transaction()
+    assert chain.add_transaction(tx)
+    a1 = mine_on_chain(chain)
+    a2 = mine_on_chain(chain)
+    for i in range(2):
+        chain.index.update_blocknumbers(blk0)
+        with pytest.raises(KeyError):
+            chain.index.get_transaction(tx.hash)
+    chain.index.update_blocknumbers(a2)
+    assert chain.index.get_transaction(tx.hash) == (tx, a1, 0)
+    assert chain.in_main_branch(a2)
+
+
+def test_transaction_index_refcount(db):
+    "rewriting the entry of a transaction on reorgs leaves its refcount"
+    k, v, k2, v2 = accounts()
+    refcount_db = RefcountDB(db)
+    blk0 = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=refcount_db)
+    chain = Chain(env=env(blk0.db), genesis=blk0)
+    tx = get_transaction()
+    assert chain.add_transaction(tx)
+    a1 = mine_on_chain(chain)
+
+    def refcount():
+        return utils.decode_int(rlp.decode(db.get(b'r:' + tx.hash))[0])
+    before = refcount()
+    for i in range(3):
+        chain.index.update_blocknumbers(blk0)
+        assert refcount() == before
+        chain.index.update_blocknumbers(a1)
+        assert refcount() == before
+    assert chain.index.get_transaction(tx.hash) == (tx, a1, 0)
+
+
 def test_add_side_chain(db, alt_db):
     """"
     Local: L0, L1, L2
@@ -0,0 +1,42 @@
+from rlp.utils import ascii_chr
+from ethereum import vm, opcodes
+
+PUSH1, PUSH2, JUMP, JUMPI, JUMPDEST, STOP = [
+    opcodes.reverse_opcodes[x] for x in
+    ('PUSH1', 'PUSH2', 'JUMP', 'JUMPI', 'JUMPDEST', 'STOP')]
+
+
+def mk_code(*ops):
+    return b''.join(ascii_chr(x) for x in ops)
+
+
+def run(code, gas=1000):
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, gas, vm.CallData([]))
+    return vm.vm_execute(vm.VmExtBase(), msg, code)
+
+
+def test_preprocess_code():
+    # PUSH2 0x5b5b JUMPDEST PUSH1 (truncated)
+    code = mk_code(PUSH2, JUMPDEST, JUMPDEST, JUMPDEST, PUSH1)
+    ops, jumpdests = vm.preprocess_code(code)
+    assert len(ops) == len(jumpdests) == len(code)
+    assert ops[0][0] == 'PUSH2' and ops[0][5] == 0x5b5b
+    assert ops[1] is None and ops[2] is None
+    assert ops[3][0] == 'JUMPDEST'
+    assert ops[4][0] == 'PUSH1' and ops[4][5] == 0
+    assert list(jumpdests) == [0, 0, 0, 1, 0]
+
+
+def test_jumps():
+    # PUSH1 4 JUMP STOP JUMPDEST PUSH1 1 PUSH1 9 JUMPI  (pc 9 is past the end)
+    code = mk_code(PUSH1, 4, JUMP, STOP, JUMPDEST, PUSH1, 1, PUSH1, 9, JUMPI)
+    assert run(code)[0] == 0
+    code = mk_code(PUSH1, 4, JUMP, STOP, JUMPDEST, PUSH1, 0, PUSH1, 9, JUMPI)
+    assert run(code)[0] == 1
+    # jump into push data that looks like a JUMPDEST
+    code = mk_code(PUSH1, 3, JUMP, PUSH1, JUMPDEST)
+    assert run(code)[0] == 0
+    code = mk_code(PUSH1, 4, JUMP, PUSH1, JUMPDEST)
+    assert run(code)[0] == 0
+    code = mk_code(PUSH1, 3, JUMP, JUMPDEST, STOP)
+    assert run(code) == (1, 1000 - 3 - 8 - 1, [])
@@ -0,0 +1,123 @@
+import multiprocessing
+import pytest
+import rlp
+from ethereum import blocks, headerchain, utils
+from ethereum.chain import Chain
+from ethereum.db import EphemDB
+from ethereum.headerchain import HeaderChain
+from ethereum.tests.test_chain import mkquickgenesis, mine_next_block, get_transaction, accounts
+
+
+def genesis():
+    k, v, k2, v2 = accounts()
+    return mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=EphemDB())
+
+
+def mine(blk, n, nonce=0):
+    chain = [blk]
+    for i in range(n):
+        chain.append(mine_next_block(chain[-1], transactions=[get_transaction(nonce=nonce + i)]))
+    return chain[1:]
+
+
+def headers(chain):
+    hs = [rlp.decode(rlp.encode(b.header), blocks.BlockHeader) for b in chain]
+    for h in hs:
+        h._mutable = True
+        h._cached_rlp = None
+    return hs
+
+
+def test_header_chain():
+    remote = mine(genesis(), 3)
+    local = genesis()
+    hc = HeaderChain(local.env, local)
+    assert hc.head == local.header
+    assert hc.add_headers(headers(remote)) == 3
+    assert hc.head == remote[-1].header
+    assert hc.get_total_difficulty(remote[-1].hash) == 4
+    assert [hc.get_hash_by_number(i) for i in range(1, 4)] == [b.hash for b in remote]
+    assert hc.add_headers([]) == 0
+
+
+def test_invalid_headers():
+    remote = mine(genesis(), 4)
+    local = genesis()
+    hc = HeaderChain(local.env, local)
+    bad_pow, bad_difficulty = headers(remote[1:3])
+    bad_pow.nonce = b'\x00' * 8
+    assert hc.add_headers(headers(remote[:1]) + [bad_pow]) == 1
+    bad_difficulty.difficulty = 2
+    assert hc.add_headers(headers(remote[1:2]) + [bad_difficulty]) == 1
+    assert hc.head == remote[1].header
+    assert hc.add_headers(headers(remote[3:])) == 0  # parent missing
+
+
+def test_extra_data_length():
+    local = genesis()
+    header = headers(mine(local, 1))[0]
+    header.extra_data = b'x' * (local.config['MAX_EXTRADATA_LENGTH'] + 1)
+    with pytest.raises(ValueError) as e:
+        blocks.validate_header(header, local.header, local.config)
+    assert 'Extra data' in str(e.value)
+    # a block decoded without its parent
+    data = rlp.decode(rlp.encode(mine(local, 1)[0]))
+    data[0][12] = b'x' * 100
+    with pytest.raises(ValueError) as e:
+        rlp.decode(rlp.encode(data), blocks.Block, env=local.env)
+    assert 'Extra data' in str(e.value)
+
+
+def test_reorg():
+    short = mine(genesis(), 2)
+    long = mine(genesis(), 3, nonce=1)
+    assert short[0] != long[0]
+    local = genesis()
+    hc = HeaderChain(local.env, local)
+    hc.add_headers(headers(short))
+    assert hc.head == short[-1].header
+    hc.add_headers(headers(long))
+    assert hc.head == long[-1].header
+    assert [hc.get_hash_by_number(i) for i in range(1, 4)] == [b.hash for b in long]
+
+
+def test_parallel_pow(monkeypatch):
+    monkeypatch.setattr(headerchain, 'PARALLEL_POW_MIN_HEADERS', 1)
+    remote = mine(genesis(), 3)
+    hs = headers(remote)
+    hs[1].nonce = b'\x00' * 8
+    pool = multiprocessing.Pool(2)
+    try:
+        assert headerchain.check_pow(hs, pool) == [True, False, True]
+    finally:
+        pool.terminate()
+    assert headerchain.check_pow(hs) == [True, False, True]
+    # a pool owned by the header chain, for the time of a batch
+    pools = []
+    Pool = multiprocessing.Pool
+
+    def make_pool(processes):
+        pools.append(Pool(processes))
+        return pools[-1]
+    monkeypatch.setattr(multiprocessing, 'Pool', make_pool)
+    local = genesis()
+    hc = HeaderChain(local.env, local, pow_processes=2)
+    assert hc.add_headers(headers(remote)) == 3
+    assert len(pools) == 1
+
+
+def test_import_bodies():
+    remote = mine(genesis(), 3)
+    local = genesis()
+    chain = Chain(env=local.env, genesis=local)
+    hc = HeaderChain(local.env, local)
+    hc.add_headers(headers(remote))
+    bodies = dict((b.hash, (b.transaction_list, b.uncles)) for b in remote)
+    assert [h.hash for h in hc.pending(chain, max_count=2)] == [b.hash for b in remote[:2]]
+    for header in hc.pending(chain):
+        txs, uncles = bodies[header.hash]
+        assert hc.import_body(chain, header.hash, txs, uncles) is not None
+    assert chain.head == remote[-1]
+    assert hc.pending(chain) == []
+    # a body not matching its header
+    assert hc.import_body(chain, remote[1].hash, [], []) is None
@@ -0,0 +1,156 @@
+import pytest
+import rlp
+from ethereum import bloom, logquery, processblock, transactions, utils
+from ethereum.blocks import Receipt
+from ethereum.pruning_trie import Trie
+from ethereum.chain import Chain, Index
+from ethereum.db import EphemDB
+from ethereum.refcount_db import RefcountDB
+from ethereum.tests.test_chain import accounts, env, mkquickgenesis, mine_on_chain
+
+
+def log_code(topic):
+    # init code: LOG1(0, 0, topic), create an empty contract
+    return b'\x60' + utils.int_to_big_endian(topic) + b'\x60\x00\x60\x00\xa1\x00'
+
+
+def make_chain(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    chain = Chain(env=env(blk.db), genesis=blk)
+    # logs in block 2 (topic 1), block 9 (topics 1 and 2)
+    logged = {2: [1], 9: [1, 2]}
+    nonce = 0
+    for number in range(1, 11):
+        for topic in logged.get(number, []):
+            tx = transactions.Transaction(nonce, 0, 100000, b'', 0, log_code(topic)).sign(k)
+            assert chain.add_transaction(tx)
+            nonce += 1
+        mine_on_chain(chain)
+    return chain
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    monkeypatch.setattr(Index, 'bloom_section_size', 4)
+    return make_chain(EphemDB())
+
+
+def test_get_logs(chain):
+    results = list(logquery.get_logs(chain, logquery.LogFilter(topics=[[1]])))
+    assert [(r[1], r[3], r[4]) for r in results] == [(2, 0, 0), (9, 0, 0)]
+    log, number, blockhash, tx_index, log_index = results[1]
+    assert list(log.topics) == [1]
+    assert blockhash == chain.index.get_block_by_number(9)
+    # the address of the contract that logged
+    f = logquery.LogFilter(addresses=[log.address])
+    assert [r[1] for r in logquery.get_logs(chain, f)] == [9]
+    f = logquery.LogFilter(topics=[[2, utils.zpad(b'\x03', 32)]])
+    assert [r[1] for r in logquery.get_logs(chain, f)] == [9]
+    f = logquery.LogFilter(topics=[None, [1]])
+    assert list(logquery.get_logs(chain, f)) == []
+    f = logquery.LogFilter(topics=[[1]])
+    assert [r[1] for r in logquery.get_logs(chain, f, from_block=3, to_block=8)] == []
+    assert [r[1] for r in logquery.get_logs(chain, f, from_block=2, to_block=2)] == [2]
+
+
+def test_bloom_bits(chain):
+    f = logquery.LogFilter(topics=[[2]])
+    bits = f.bloom_bits[0][0]
+    # block 9 is the second block of section 2
+    for bit in bits:
+        assert chain.index.get_bloom_bits(2, bit) & 2
+        assert chain.index.get_bloom_bits(0, bit) == 0
+    assert f.match_bloom_bits(lambda bit: chain.index.get_bloom_bits(2, bit), 0xf) == 2
+
+
+def test_only_candidates_searched(chain, monkeypatch):
+    searched = []
+    get_block_logs = logquery._get_block_logs
+    monkeypatch.setattr(logquery, '_get_block_logs',
+                        lambda c, f, n: searched.append(n) or get_block_logs(c, f, n))
+    f = logquery.LogFilter(topics=[[2]])
+    assert [r[1] for r in logquery.get_logs(chain, f)] == [9]
+    assert searched == [9]
+    # any log, up to the head
+    f = logquery.LogFilter()
+    assert [r[1] for r in logquery.get_logs(chain, f, from_block=5, to_block=20)] == [9, 9]
+    assert searched[1:] == [5, 6, 7, 8, 9, 10]
+
+
+def test_bloom_bits_reorg(chain):
+    f = logquery.LogFilter(topics=[[1]])
+    assert [r[1] for r in logquery.get_logs(chain, f)] == [2, 9]
+    # a new branch after block 1, without the log of block 2
+    mine_on_chain(chain, parent=chain.get(chain.index.get_block_by_number(1)))
+    assert chain.head.number == 2
+    assert list(logquery.get_logs(chain, f)) == []
+    for bits in f.bloom_bits[0]:
+        assert all(chain.index.get_bloom_bits(s, bit) == 0 for s in range(3) for bit in bits)
+
+
+@pytest.mark.parametrize('db', [EphemDB, lambda: RefcountDB(EphemDB())])
+def test_bloom_bits_rollback(monkeypatch, db):
+    monkeypatch.setattr(Index, 'bloom_section_size', 4)
+    chain = make_chain(db())
+    f = logquery.LogFilter(topics=[[1]])
+    block1 = chain.get(chain.index.get_block_by_number(1))
+    head = chain.head
+    # back to block 1 and forward again, twice
+    for i in range(2):
+        chain.index.update_blocknumbers(block1)
+        assert list(logquery.get_logs(chain, f)) == []
+        for bits in f.bloom_bits[0]:
+            assert all(chain.index.get_bloom_bits(s, bit) == 0
+                       for s in range(3) for bit in bits)
+        chain.index.update_blocknumbers(head)
+        assert [r[1] for r in logquery.get_logs(chain, f)] == [2, 9]
+
+
+def test_receipts_and_bloom(chain, monkeypatch):
+    block = chain.get(chain.index.get_block_by_number(9))
+    receipts = chain.get_receipts(block.hash)
+    # the receipt trie built in bulk, the same as updated per transaction
+    receipt_trie = Trie(EphemDB())
+    value = 0
+    for i, receipt in enumerate(receipts):
+        receipt_trie.update(rlp.encode(i), rlp.encode(receipt))
+        value |= receipt.bloom
+    assert receipt_trie.root_hash == block.receipts_root
+    assert value and value == block.bloom
+    # the address and topics of a log are hashed once
+    calls = []
+    bloom_from_list = bloom.bloom_from_list
+    monkeypatch.setattr(bloom, 'bloom_from_list',
+                        lambda args: calls.append(args) or bloom_from_list(args))
+    log = receipts[1].logs[0]
+    log = processblock.Log(log.address, log.topics, log.data)
+    receipt = Receipt(receipts[1].state_root, receipts[1].gas_used, [log])
+    assert receipt.bloom == receipts[1].bloom
+    assert log.bloom == bloom_from_list(log.bloomables())
+    rlp.decode(rlp.encode(receipt), Receipt)
+    assert len(calls) == 2  # the new log and the decoded one
+
+
+def test_indexed_before_bloom_bits(chain, monkeypatch):
+    db = chain.db
+    bits = dict((k, v) for k, v in db.kv.items() if k.startswith(b'bloombits:'))
+    # a database indexed without bloom bits, then upgraded at block 10
+    for key in bits:
+        db.delete(key)
+    assert chain.index.bloom_bits_start() == 11
+    chain.index.update_blocknumbers(chain.head)
+    assert chain.index.bloom_bits_start() == 11
+    searched = []
+    get_block_logs = logquery._get_block_logs
+    monkeypatch.setattr(logquery, '_get_block_logs',
+                        lambda c, f, n: searched.append(n) or get_block_logs(c, f, n))
+    f = logquery.LogFilter(topics=[[1]])
+    # the blooms in the headers are checked instead
+    assert [r[1] for r in logquery.get_logs(chain, f)] == [2, 9]
+    assert searched == [2, 9]
+    assert chain.index.backfill_bloom_bits(count=3) == 8
+    assert [r[1] for r in logquery.get_logs(chain, f, from_block=1)] == [2, 9]
+    assert chain.index.backfill_bloom_bits() == 0
+    assert dict((k, v) for k, v in db.kv.items() if k.startswith(b'bloombits:')) == \
+        dict(bits, **{b'bloombits:start': utils.encode_int(0)})
@@ -0,0 +1,75 @@
+import multiprocessing
+import rlp
+from ethereum import blocks, transactions, utils
+from ethereum.chain import Chain
+from ethereum.db import EphemDB
+from ethereum.pipeline import ImportPipeline
+from ethereum.tests.test_chain import mkquickgenesis, mine_next_block, get_transaction, accounts
+
+
+def remote_chain(n):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=EphemDB())
+    chain = [blk]
+    for i in range(n):
+        blk = mine_next_block(blk, transactions=[get_transaction(nonce=i)])
+        chain.append(blk)
+    return chain
+
+
+def local_chain():
+    k, v, k2, v2 = accounts()
+    genesis = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=EphemDB())
+    return Chain(env=blocks.Env(genesis.db), genesis=genesis)
+
+
+def test_import():
+    remote = remote_chain(4)
+    chain = local_chain()
+    pipeline = ImportPipeline(chain, queue_size=1)
+    added = pipeline.run(rlp.encode(b) for b in remote[1:])
+    assert [b.hash for b in added] == [b.hash for b in remote[1:]]
+    assert chain.head == remote[-1]
+    for stage in ('decode', 'verify', 'execute', 'persist'):
+        metrics = pipeline.metrics[stage]
+        assert metrics.count == 4
+        assert metrics.failed == 0
+        assert metrics.busy >= metrics.max > 0
+
+
+def test_rejected_blocks():
+    remote = remote_chain(2)
+    chain = local_chain()
+    bad_pow = rlp.decode(rlp.encode(remote[1]))
+    bad_pow[0][-1] = b'\x00' * 8
+    orphan = remote[2]
+    pipeline = ImportPipeline(chain)
+    added = pipeline.run([b'\x01\x02', rlp.encode(bad_pow), rlp.encode(orphan),
+                          rlp.encode(remote[1])])
+    assert added == [remote[1]]
+    assert pipeline.metrics['decode'].failed == 1
+    assert pipeline.metrics['verify'].failed == 1
+    assert pipeline.metrics['execute'].failed == 1
+    assert pipeline.metrics['persist'].count == 1
+
+
+def test_recovery_pool(monkeypatch):
+    monkeypatch.setattr(transactions, 'PARALLEL_RECOVERY_MIN_TXS', 1)
+    recovered = []
+    Pool = multiprocessing.Pool
+
+    def pool(processes):
+        p = Pool(processes)
+        map_ = p.map
+        p.map = lambda f, args: recovered.extend(args) or map_(f, args)
+        return p
+    monkeypatch.setattr(multiprocessing, 'Pool', pool)
+    remote = remote_chain(2)
+    transactions.sender_cache.clear()
+    chain = local_chain()
+    pipeline = ImportPipeline(chain, recovery_processes=2)
+    added = pipeline.run([rlp.encode(b) for b in remote[1:]])
+    assert [b.hash for b in added] == [b.hash for b in remote[1:]]
+    assert len(recovered) == 2
+    # the pool only lives as long as the import
+    assert pipeline._pool is None
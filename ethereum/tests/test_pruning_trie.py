@@ -438,6 +438,33 @@ def run_test(name):
         assert pairs['root'] == b'0x' + utils.encode_hex(t.root_hash), (i, list(permut) + deletes)
 
 
+def test_update_all():
+    NODES = 60
+    items = [(rlp.encode(i), to_string(i ** 3)) for i in range(NODES)]
+    items += [(b'', b'empty'), (b'\x01', b'prefix'), (b'\x01\x02', b'long')]
+    t = pruning_trie.Trie(EphemDB())
+    for k, v in items:
+        t.update(k, v)
+    db = RefcountDB(EphemDB())
+    db.ttl = 0
+    t2 = pruning_trie.Trie(db)
+    t2.update_all(items)
+    assert t2.root_hash == t.root_hash
+    assert t2.to_dict() == t.to_dict()
+    db.commit_refcount_changes(0)
+    db.cleanup(0)
+    check_db_tightness([t2], db)
+    t2.clear_all()
+    db.commit_refcount_changes(1)
+    db.cleanup(1)
+    assert len(db.kv) == 0
+    # not blank: updated one by one
+    t3 = pruning_trie.Trie(EphemDB())
+    t3.update_all(items[:1])
+    t3.update_all(items[1:])
+    assert t3.root_hash == t.root_hash
+
+
 def test_emptyValues():
     run_test('emptyValues')
 
@@ -0,0 +1,104 @@
+import multiprocessing
+import pytest
+import rlp
+from ethereum import transactions, utils
+from ethereum.exceptions import InvalidTransaction
+
+keys = [utils.sha3(str(i)) for i in range(4)]
+
+
+def mktxs():
+    txs = []
+    for i, k in enumerate(keys):
+        tx = transactions.Transaction(i, 1, 100000, b'\x35' * 20, i, b'data')
+        txs.append(tx.sign(k))
+    return txs
+
+
+def decoded(txs):
+    return [rlp.decode(rlp.encode(tx), transactions.Transaction) for tx in txs]
+
+
+@pytest.fixture
+def no_cache():
+    transactions.sender_cache.clear()
+
+
+def test_sender_cache(no_cache, monkeypatch):
+    txs = mktxs()
+    transactions.sender_cache.clear()
+    senders = [tx.sender for tx in decoded(txs)]
+    assert senders == [utils.privtoaddr(k) for k in keys]
+    assert len(transactions.sender_cache) == len(keys)
+
+    def fail(*args):
+        raise AssertionError('sender not taken from cache')
+    monkeypatch.setattr(transactions, 'ecrecover_sender', fail)
+    assert [tx.sender for tx in decoded(txs)] == senders
+
+
+def test_sender_cache_size(no_cache, monkeypatch):
+    monkeypatch.setattr(transactions.sender_cache, 'max_items', 2)
+    txs = mktxs()
+    assert list(transactions.sender_cache.keys()) == [tx.hash for tx in txs[-2:]]
+    assert transactions.get_cached_sender(txs[2].hash) == txs[2].sender
+    transactions.cache_sender(b'x' * 32, b'y' * 20)
+    assert list(transactions.sender_cache.keys()) == [txs[2].hash, b'x' * 32]
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_recover_senders(no_cache, monkeypatch, parallel):
+    txs = mktxs()
+    expected = [tx.sender for tx in txs]
+    txs = decoded(txs)
+    bad = transactions.Transaction(0, 1, 100000, b'\x35' * 20, 0, b'', 27, 0, 1)
+    transactions.sender_cache.clear()
+    monkeypatch.setattr(transactions, 'PARALLEL_RECOVERY_MIN_TXS', 1)
+    pool = multiprocessing.Pool(2) if parallel else None
+    try:
+        transactions.recover_senders(txs + [bad], pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    assert [tx._sender for tx in txs] == expected
+    assert bad._sender is None
+    with pytest.raises(InvalidTransaction):
+        bad.sender
+    assert len(transactions.sender_cache) == len(txs)
+
+
+def test_memoized_metadata():
+    tx = transactions.Transaction(0, 1, 100000, b'\x35' * 20, 0, b'\x00\x01')
+    h, uh, gas = tx.hash, tx.unsigned_hash, tx.intrinsic_gas_used
+    assert h == utils.sha3(rlp.encode(tx))
+    assert uh == utils.sha3(rlp.encode(tx, transactions.UnsignedTransaction))
+    tx.sign(keys[0])
+    assert tx.unsigned_hash == uh
+    assert tx.hash != h
+    assert tx.hash == utils.sha3(rlp.encode(tx))
+    tx.data = b'\x01\x01\x01'
+    assert tx.intrinsic_gas_used > gas
+    assert tx.unsigned_hash != uh
+    assert tx.hash == utils.sha3(rlp.encode(tx))
+    tx2 = rlp.decode(rlp.encode(tx), transactions.Transaction)
+    assert tx2.hash == tx.hash
+    assert tx2.intrinsic_gas_used == tx.intrinsic_gas_used
+
+
+def test_prevalidate_transactions(no_cache):
+    from ethereum import blocks, processblock
+    from ethereum.db import EphemDB
+    from ethereum.config import Env
+    from ethereum.exceptions import InsufficientStartGas
+    block = blocks.genesis(Env(EphemDB()))
+    txs = mktxs()
+    processblock.prevalidate_transactions(block, txs)
+    assert all(tx._prevalidated is not None for tx in txs)
+    # changing a field drops the mark
+    txs[0].startgas = 21000
+    assert txs[0]._prevalidated is None
+    txs[0].startgas = 100
+    with pytest.raises(InsufficientStartGas):
+        processblock.prevalidate_transactions(block, txs)
+    with pytest.raises(InsufficientStartGas):
+        processblock.validate_transaction(block, txs[0])
@@ -0,0 +1,117 @@
+import pytest
+from ethereum import tester, blocks, processblock, speculation, transactions, utils
+
+counter_code = """
+def inc():
+    self.storage[0] += 1
+    return(self.storage[0])
+"""
+
+setter_code = """
+def set(k, v):
+    self.storage[k] = v
+    log(k, v)
+    return(v)
+"""
+
+coinbase_code = """
+def get():
+    return(block.coinbase.balance)
+"""
+
+suicide_code = """
+def kill():
+    suicide(msg.sender)
+"""
+
+
+@pytest.fixture
+def chain():
+    s = tester.state()
+    contracts = dict(counter=s.abi_contract(counter_code),
+                     setter=s.abi_contract(setter_code),
+                     coinbase=s.abi_contract(coinbase_code),
+                     suicide=s.abi_contract(suicide_code))
+    s.mine(1)
+    return s, contracts
+
+
+def mkblocks(s):
+    parent = s.blocks[-2]
+    return [blocks.Block.init_from_parent(parent, tester.a9, timestamp=parent.timestamp + 10)
+            for _ in range(2)]
+
+
+def mktxs(block, calls):
+    nonces = {}
+    txs = []
+    for key, contract, func, args in calls:
+        sender = utils.privtoaddr(key)
+        nonce = nonces.get(sender, block.get_nonce(sender))
+        nonces[sender] = nonce + 1
+        data = contract._translator.encode(func, args)
+        txs.append(transactions.Transaction(nonce, 1, 200000, contract.address, 0, data).sign(key))
+    return txs
+
+
+def check_identical(s, calls, processes=1, reexecuted=None, monkeypatch=None):
+    serial, speculative = mkblocks(s)
+    txs = mktxs(serial, calls)
+    expected = [processblock.apply_transaction(serial, tx) for tx in txs]
+    replayed = []
+    if monkeypatch is not None:
+        replay = speculation._replay
+        monkeypatch.setattr(speculation, '_replay',
+                            lambda block, spec: replayed.append(spec) or replay(block, spec))
+    assert speculation.apply_transactions(speculative, txs, processes) == expected
+    for attr in ('state_root', 'receipts_root', 'tx_list_root', 'gas_used',
+                 'bloom', 'ether_delta'):
+        assert getattr(speculative, attr) == getattr(serial, attr)
+    assert [r.logs for r in speculative.get_receipts()] == [r.logs for r in serial.get_receipts()]
+    if reexecuted is not None:
+        assert len(replayed) == len(txs) - reexecuted
+
+
+def test_disjoint_transactions(chain, monkeypatch):
+    s, c = chain
+    calls = [(k, c['setter'], 'set', [i, i + 1]) for i, k in enumerate(tester.keys[:5])]
+    check_identical(s, calls, reexecuted=0, monkeypatch=monkeypatch)
+
+
+def test_conflicting_transactions(chain, monkeypatch):
+    s, c = chain
+    calls = [(tester.k0, c['counter'], 'inc', []),
+             (tester.k1, c['setter'], 'set', [1, 2]),
+             (tester.k2, c['counter'], 'inc', []),  # reads slot 0
+             (tester.k1, c['setter'], 'set', [3, 4]),  # nonce of k1
+             (tester.k3, c['coinbase'], 'get', []),  # reads the fees
+             (tester.k4, c['setter'], 'set', [1, 5]),  # SSTORE reads slot 1
+             (tester.k5, c['setter'], 'set', [2, 5])]
+    check_identical(s, calls, reexecuted=4, monkeypatch=monkeypatch)
+
+
+def test_suicide(chain):
+    s, c = chain
+    calls = [(tester.k0, c['suicide'], 'kill', []),
+             (tester.k1, c['suicide'], 'kill', []),
+             (tester.k2, c['setter'], 'set', [7, 7])]
+    check_identical(s, calls)
+
+
+def test_parallel(chain, monkeypatch):
+    s, c = chain
+    monkeypatch.setattr(speculation, 'PARALLEL_SPECULATION_MIN_TXS', 1)
+    calls = [(k, c['counter'] if i % 3 else c['setter'], 'inc' if i % 3 else 'set',
+              [] if i % 3 else [i, i]) for i, k in enumerate(tester.keys * 2)]
+    check_identical(s, calls, processes=2)
+
+
+def test_access_recorder(chain):
+    s, c = chain
+    block = mkblocks(s)[0]
+    block.access_recorder = set()
+    block.get_storage_data(c['counter'].address, 0)
+    block.get_balance(tester.a1)
+    assert block.access_recorder == set([(b'storage:' + c['counter'].address, 0),
+                                         ('storage', c['counter'].address),
+                                         ('balance', tester.a1)])
@@ -0,0 +1,128 @@
+import json
+from io import BytesIO
+
+from ethereum import tester, processblock, transactions, utils
+from ethereum.tracer import Tracer, JSONLinesTracer
+
+setter_code = """
+def set(k, v):
+    self.storage[k] = v
+    return(self.storage[k])
+"""
+
+caller_code = """
+extern setter: [set:[int256,int256]:int256]
+
+def relay(target, k, v):
+    return(target.set(k, v))
+"""
+
+
+def apply_traced(s, to, data, tracer):
+    tx = transactions.Transaction(s.block.get_nonce(tester.a0), tester.gas_price,
+                                  tester.gas_limit, to, 0, data)
+    tx.sign(tester.k0)
+    return processblock.apply_transaction(s.block, tx, tracer)
+
+
+def trace_records(s, to, data):
+    out = BytesIO()
+    success, output = apply_traced(s, to, data, JSONLinesTracer(out))
+    assert success
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_jsonlines_tracer():
+    s = tester.state()
+    c = s.abi_contract(setter_code)
+    records = trace_records(s, c.address, c._translator.encode('set', [3, 42]))
+    assert records[0]['t'] == 'call'
+    assert records[0]['to'] == utils.encode_hex(c.address)
+    assert records[-1]['t'] == 'return'
+    assert records[-1]['ok'] == 1
+    assert records[-1]['out'] == utils.encode_hex(utils.zpad(utils.encode_int(42), 32))
+    steps = [r for r in records if r['t'] == 'step']
+    assert steps[0]['pc'] == 0
+    assert all(r['d'] == 0 for r in steps)
+    sstores = [r for r in records if r['t'] == 'sstore']
+    assert sstores == [{'t': 'sstore', 'd': 0, 'addr': utils.encode_hex(c.address),
+                        'key': '0x3', 'value': '0x2a'}]
+    sloads = [r for r in records if r['t'] == 'sload']
+    assert sloads[-1]['value'] == '0x2a'
+    # the memory diff of the step after the final MSTORE holds the return value
+    assert any(utils.encode_hex(utils.zpad(utils.encode_int(42), 32)) in r.get('mem', {}).values()
+               for r in steps)
+
+
+def test_nested_calls():
+    s = tester.state()
+    setter = s.abi_contract(setter_code)
+    caller = s.abi_contract(caller_code)
+    data = caller._translator.encode('relay', [setter.address, 5, 9])
+    records = trace_records(s, caller.address, data)
+    calls = [r for r in records if r['t'] in ('call', 'return')]
+    assert [(r['t'], r['d']) for r in calls] == \
+        [('call', 0), ('call', 1), ('return', 1), ('return', 0)]
+    assert calls[1]['to'] == utils.encode_hex(setter.address)
+    sstore = [r for r in records if r['t'] == 'sstore'][0]
+    assert sstore['d'] == 1
+    assert sstore['addr'] == utils.encode_hex(setter.address)
+    assert s.block.get_storage_data(setter.address, 5) == 9
+
+
+def test_tracer_does_not_change_execution():
+    traced, plain = tester.state(), tester.state()
+    for s, tracer in ((traced, Tracer()), (plain, None)):
+        c = s.abi_contract(setter_code)
+        assert apply_traced(s, c.address, c._translator.encode('set', [1, 2]), tracer) == \
+            (1, utils.zpad(utils.encode_int(2), 32))
+    assert traced.block.state_root == plain.block.state_root
+    assert traced.block.gas_used == plain.block.gas_used
+
+
+class MemoryCheckingTracer(JSONLinesTracer):
+
+    """Rebuilds the memory of each frame from the emitted records and
+    compares it with the actual memory at every step."""
+
+    def __init__(self):
+        super(MemoryCheckingTracer, self).__init__(BytesIO())
+        self.memories = {}
+        self.words = 0
+
+    def step(self, msg, compustate, op, pushval, fee):
+        super(MemoryCheckingTracer, self).step(msg, compustate, op, pushval, fee)
+        record = json.loads(self.out.getvalue().splitlines()[-1])
+        memory = self.memories.setdefault(msg, [])
+        if 'msize' in record:
+            memory.extend([0] * (record['msize'] - len(memory)))
+        for offset, word in record.get('mem', {}).items():
+            offset = int(offset)
+            memory[offset: offset + 32] = list(bytearray(utils.decode_hex(word)))
+            self.words += 1
+        assert memory == list(compustate.memory)
+
+
+def test_memory_diffs():
+    s = tester.state()
+    setter = s.abi_contract(setter_code)
+    caller = s.abi_contract(caller_code)
+    tracer = MemoryCheckingTracer()
+    data = caller._translator.encode('relay', [setter.address, 5, 9])
+    assert apply_traced(s, caller.address, data, tracer)[0]
+    assert tracer.words
+    assert len(tracer.memories) == 2
+
+
+def test_log_tracer_invalid_op():
+    from ethereum import slogging
+    slogging.configure('eth.vm.op:TRACE')
+    try:
+        s = tester.state()
+        # init code: PUSH1 0, INVALID
+        tx = transactions.contract(s.block.get_nonce(tester.a0), tester.gas_price,
+                                   tester.gas_limit, 0, b'\x60\x00\xfe').sign(tester.k0)
+        success, output = processblock.apply_transaction(s.block, tx)
+        assert not success
+    finally:
+        slogging.configure()
@@ -0,0 +1,68 @@
+from ethereum import transactions, utils
+from ethereum.txpool import TransactionPool
+
+keys = [utils.sha3(b'txpool%d' % i) for i in range(3)]
+senders = [utils.privtoaddr(k) for k in keys]
+
+
+def mktx(key, nonce, gasprice, value=0):
+    return transactions.Transaction(nonce, gasprice, 21000, b'\x35' * 20, value,
+                                    b'').sign(keys[key])
+
+
+def test_add_and_replace():
+    pool = TransactionPool(price_bump=10)
+    tx = mktx(0, 0, 100)
+    assert pool.add(tx)
+    assert not pool.add(tx)
+    assert tx.hash in pool and len(pool) == 1
+    # less than 10% more is not enough to replace
+    assert not pool.add(mktx(0, 0, 109))
+    assert pool.get(senders[0], 0) == tx
+    tx2 = mktx(0, 0, 110)
+    assert pool.add(tx2)
+    assert pool.get(senders[0], 0) == tx2
+    assert tx.hash not in pool and len(pool) == 1
+
+
+def test_size_limits():
+    pool = TransactionPool(max_size=3, max_per_sender=2)
+    assert pool.add(mktx(0, 0, 5))
+    assert pool.add(mktx(0, 1, 1))
+    assert not pool.add(mktx(0, 2, 10))
+    assert pool.add(mktx(1, 0, 3))
+    # the pool is full, the cheapest last tx of a sender goes
+    assert pool.add(mktx(2, 0, 4))
+    assert len(pool) == 3
+    assert pool.get(senders[0], 1) is None
+    assert pool.get(senders[0], 0) is not None
+    # a new tx cheaper than everything evictable is dropped right away
+    assert not pool.add(mktx(2, 1, 1))
+    assert len(pool) == 3
+
+
+def test_ordered():
+    pool = TransactionPool()
+    txs = [mktx(0, 0, 1), mktx(0, 1, 50), mktx(1, 0, 10), mktx(1, 1, 10),
+           mktx(2, 1, 100), mktx(2, 3, 100)]
+    for tx in txs:
+        pool.add(tx)
+    nonces = {senders[0]: 0, senders[1]: 0, senders[2]: 1}
+
+    def apply_all(skip=()):
+        state = dict(nonces)
+        applied = []
+        for tx in pool.ordered(lambda s: state[s]):
+            if tx not in skip:
+                state[tx.sender] += 1
+                applied.append(tx)
+        return applied
+
+    assert apply_all() == [txs[4], txs[2], txs[3], txs[0], txs[1]]
+    # a tx that was not applied blocks the later ones of its sender
+    assert apply_all(skip=[txs[2]]) == [txs[4], txs[0], txs[1]]
+
+    nonces[senders[1]] = 1
+    pool.prune(lambda s: nonces[s])
+    assert txs[2].hash not in pool and txs[3].hash in pool
+    assert list(pool) == [txs[0], txs[1], txs[3], txs[4], txs[5]]
@@ -0,0 +1,31 @@
+import pytest
+from ethereum import vm
+
+
+def test_calldata_is_view_of_parent_memory():
+    mem = list(range(10))
+    cd = vm.CallData(mem, 2, 5)
+    mem[3] = 99
+    assert cd.extract32(0) == int('0263' + '040506' + '00' * 27, 16)
+    assert cd.extract_all() == b'\x02\x63\x04\x05\x06'
+
+
+@pytest.mark.parametrize('datastart,size', [
+    (0, 0), (0, 3), (0, 5), (0, 8), (3, 4), (5, 3), (9, 2), (2 ** 255, 2)])
+def test_calldata_extract_copy(datastart, size):
+    cd = vm.CallData(list(range(1, 11)), 2, 5)
+    mem = [0xff] * 12
+    cd.extract_copy(mem, 1, datastart, size)
+    expected = [0xff] * 12
+    for i in range(size):
+        expected[1 + i] = 3 + datastart + i if datastart + i < 5 else 0
+    assert mem == expected
+
+
+def test_frames_are_slotted():
+    msg = vm.Message(b'\x00' * 20, b'\x00' * 20, 0, 1000, vm.CallData([]))
+    compustate = vm.Compustate(gas=msg.gas)
+    assert compustate.gas == 1000 and compustate.pc == 0
+    for o in (msg, compustate, msg.data):
+        with pytest.raises(AttributeError):
+            o.misspelled = 1
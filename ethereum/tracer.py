@@ -0,0 +1,251 @@
+"""
+Execution tracers for the VM.
+
+A tracer is attached to the external interface of a transaction
+(``ext.tracer``, see :func:`ethereum.processblock.apply_transaction`) and
+gets called by :func:`ethereum.vm.vm_execute` for every executed opcode,
+by :func:`ethereum.processblock._apply_msg` when a message call is entered
+or left and whenever contract storage is read or written.
+
+:class:`JSONLinesTracer` streams one compact record per event to a file.
+Instead of full dumps, each step only carries what changed since the
+previous step of the same call frame: the values pushed onto the stack and
+the memory words that were written. Storage is only reported per accessed
+slot.
+
+:class:`LogTracer` emits the classic ``eth.vm.op`` trace events through
+:mod:`ethereum.slogging` and is used by the VM if no tracer is set but
+tracing is enabled in the logging configuration.
+"""
+import json
+
+from rlp.utils import encode_hex, ascii_chr
+
+from ethereum import opcodes
+from ethereum import utils
+from ethereum.utils import to_string, is_string
+from ethereum.slogging import get_logger
+
+log_vm_op = get_logger('eth.vm.op')
+
+# ops after which the memory of the current frame may have changed
+MEMORY_WRITING_OPS = set(['MSTORE', 'MSTORE8', 'CALLDATACOPY', 'CODECOPY',
+                          'EXTCODECOPY', 'CALL', 'CALLCODE', 'DELEGATECALL'])
+# ops after which the memory may have been extended
+MEMORY_EXTENDING_OPS = MEMORY_WRITING_OPS | set(['MLOAD', 'SHA3', 'CREATE',
+                                                 'RETURN', 'LOG0', 'LOG1',
+                                                 'LOG2', 'LOG3', 'LOG4'])
+
+_out_args = dict((v[0], v[2]) for v in opcodes.opcodes.values())
+
+
+def _written_range(op, stack):
+    """The memory `(offset, size)` that `op` may write to, taken from its
+    operands before it is executed."""
+    if op == 'MSTORE':
+        return stack[-1], 32
+    if op == 'MSTORE8':
+        return stack[-1], 1
+    if op in ('CALLDATACOPY', 'CODECOPY'):
+        return stack[-1], stack[-3]
+    if op == 'EXTCODECOPY':
+        return stack[-2], stack[-4]
+    if op in ('CALL', 'CALLCODE'):
+        return stack[-6], stack[-7]
+    if op == 'DELEGATECALL':
+        return stack[-5], stack[-6]
+    return None
+
+
+def _bytes_to_hex(data):
+    return encode_hex(b''.join(map(ascii_chr, data)))
+
+
+class Tracer(object):
+
+    """Base class of all tracers, all hooks default to no-ops."""
+
+    def step(self, msg, compustate, op, pushval, fee):
+        """Called before `op` at ``compustate.pc - 1`` is executed.
+
+        :param msg: the :class:`ethereum.vm.Message` being executed
+        :param compustate: the frame state (`pc` already points to the next
+                           op, `gas` already has `fee` deducted)
+        :param op: the name of the op
+        :param pushval: the value pushed if `op` is a PUSH
+        :param fee: the base fee charged for `op`
+        """
+        pass
+
+    def enter_call(self, msg):
+        """Called before a message call (or contract creation) executes."""
+        pass
+
+    def exit_call(self, msg, result, gas, data):
+        """Called after a message call returned `result`, `gas` and `data`."""
+        pass
+
+    def storage(self, msg, key, value, write):
+        """Called on each storage access of the account ``msg.to``.
+
+        :param write: `True` for `SSTORE`, `False` for `SLOAD`
+        """
+        pass
+
+
+class LogTracer(Tracer):
+
+    """Emits the per step ``eth.vm.op`` trace events of a single frame.
+
+    This diverges from normal logging, as we use the logging namespace
+    only to decide which features get logged in 'eth.vm.op'
+    i.e. tracing can not be activated by activating a sub
+    like 'eth.vm.op.stack'
+    """
+
+    def __init__(self, ext):
+        self.ext = ext
+        self.steps = 0
+        self.prevop = None
+
+    def step(self, msg, compustate, op, pushval, fee):
+        trace_data = {}
+        trace_data['stack'] = list(map(to_string, list(compustate.stack)))
+        if self.prevop in ('MLOAD', 'MSTORE', 'MSTORE8', 'SHA3', 'CALL',
+                           'CALLCODE', 'CREATE', 'CALLDATACOPY', 'CODECOPY',
+                           'EXTCODECOPY'):
+            if len(compustate.memory) < 1024:
+                trace_data['memory'] = \
+                    b''.join([encode_hex(ascii_chr(x)) for x
+                              in compustate.memory])
+            else:
+                trace_data['sha3memory'] = \
+                    encode_hex(utils.sha3(''.join([ascii_chr(x) for
+                                          x in compustate.memory])))
+        if self.prevop in ('SSTORE', 'SLOAD') or self.steps == 0:
+            trace_data['storage'] = self.ext.log_storage(msg.to)
+        trace_data['gas'] = to_string(compustate.gas + fee)
+        trace_data['inst'] = opcodes.reverse_opcodes.get(op)  # None if INVALID
+        trace_data['pc'] = to_string(compustate.pc - 1)
+        if self.steps == 0:
+            trace_data['depth'] = msg.depth
+            trace_data['address'] = msg.to
+        trace_data['op'] = op
+        trace_data['steps'] = self.steps
+        if op[:4] == 'PUSH':
+            trace_data['pushvalue'] = pushval
+        log_vm_op.trace('vm', **trace_data)
+        self.steps += 1
+        self.prevop = op
+
+
+class _Frame(object):
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.memory = []
+        self.prevop = None
+        self.written = None  # memory range the previous op may write to
+
+
+class JSONLinesTracer(Tracer):
+
+    """Streams a compact trace as JSON lines to a file.
+
+    Records are distinguished by their ``t`` field:
+
+    - ``step``: ``d`` (depth), ``pc``, ``op``, ``gas`` (before the op),
+      ``push`` (hex values the previous op of this frame pushed),
+      ``mem`` (offset -> hex word, for words written by the previous op)
+      and ``msize`` (if the memory size changed)
+    - ``call``: ``d``, ``from``, ``to``, ``code``, ``value``, ``gas``,
+      ``data``
+    - ``return``: ``d``, ``ok``, ``gas``, ``out``
+    - ``sload``/``sstore``: ``d``, ``addr``, ``key``, ``value``
+
+    :param out: a writable file object or a path
+    :param full_stack: include the complete stack with every step
+    """
+
+    def __init__(self, out, full_stack=False):
+        if is_string(out):
+            out = open(out, 'w')
+            self._owns_file = True
+        else:
+            self._owns_file = False
+        self.out = out
+        self.full_stack = full_stack
+        self._frames = {}
+
+    def _emit(self, record):
+        self.out.write(json.dumps(record, separators=(',', ':')))
+        self.out.write('\n')
+
+    def _frame(self, msg):
+        frame = self._frames.get(msg.depth)
+        if frame is None or frame.msg is not msg:
+            frame = self._frames[msg.depth] = _Frame(msg)
+        return frame
+
+    def step(self, msg, compustate, op, pushval, fee):
+        frame = self._frame(msg)
+        stack = compustate.stack
+        record = {'t': 'step', 'd': msg.depth, 'pc': compustate.pc - 1,
+                  'op': op, 'gas': compustate.gas + fee}
+        prevop = frame.prevop
+        if self.full_stack:
+            record['stack'] = ['0x%x' % x for x in stack]
+        elif prevop is not None and _out_args[prevop]:
+            record['push'] = ['0x%x' % x for x in stack[-_out_args[prevop]:]]
+        if prevop in MEMORY_EXTENDING_OPS:
+            mem, shadow = compustate.memory, frame.memory
+            if len(mem) != len(shadow):
+                record['msize'] = len(mem)
+                # extended memory is zeroed
+                shadow.extend([0] * (len(mem) - len(shadow)))
+            if frame.written is not None:
+                # only the words of the range the op wrote to
+                offset, size = frame.written
+                diff = {}
+                for i in range(offset // 32 * 32, min(offset + size, len(mem)), 32):
+                    word = mem[i: i + 32]
+                    if word != shadow[i: i + 32]:
+                        diff[str(i)] = _bytes_to_hex(word)
+                        shadow[i: i + 32] = word
+                if diff:
+                    record['mem'] = diff
+        self._emit(record)
+        frame.prevop = op
+        frame.written = None
+        if op in MEMORY_WRITING_OPS:
+            written = _written_range(op, stack)
+            if written[1]:
+                frame.written = written
+
+    def enter_call(self, msg):
+        self._emit({'t': 'call', 'd': msg.depth,
+                    'from': encode_hex(msg.sender), 'to': encode_hex(msg.to),
+                    'code': encode_hex(msg.code_address or b''),
+                    'value': msg.value, 'gas': msg.gas,
+                    'data': encode_hex(msg.data.extract_all())})
+
+    def exit_call(self, msg, result, gas, data):
+        self._frames.pop(msg.depth, None)
+        if utils.is_string(data):  # contract creation returns the address
+            out = encode_hex(data)
+        else:
+            out = _bytes_to_hex(data)
+        self._emit({'t': 'return', 'd': msg.depth, 'ok': result,
+                    'gas': gas, 'out': out})
+        if msg.depth == 0:
+            self.out.flush()
+
+    def storage(self, msg, key, value, write):
+        self._emit({'t': 'sstore' if write else 'sload', 'd': msg.depth,
+                    'addr': encode_hex(msg.to), 'key': '0x%x' % key,
+                    'value': '0x%x' % value})
+
+    def close(self):
+        self.out.flush()
+        if self._owns_file:
+            self.out.close()
@@ -1,4 +1,5 @@
 # -*- coding: utf8 -*-
+from collections import OrderedDict
 import rlp
 from bitcoin import encode_pubkey, N, P, encode_privkey
 from rlp.sedes import big_endian_int, binary
@@ -18,6 +19,57 @@ log = get_logger('eth.chain.tx')
 # in the yellow paper it is specified that s should be smaller than secpk1n (eq.205)
 secpk1n = 115792089237316195423570985008687907852837564279074904382605163141518161494337
 
+# tx hash -> sender, for transactions that are decoded more than once
+sender_cache = OrderedDict()
+sender_cache.max_items = 8192
+
+
+def get_cached_sender(txhash):
+    sender = sender_cache.pop(txhash, None)
+    if sender is not None:
+        sender_cache[txhash] = sender  # pop and append at end
+    return sender
+
+
+def cache_sender(txhash, sender):
+    sender_cache[txhash] = sender
+    if len(sender_cache) > sender_cache.max_items:
+        sender_cache.popitem(last=False)  # remove least recently accessed
+
+
+def ecrecover_sender(rawhash, v, r, s):
+    """Recover the sender address from the hash and signature of a tx.
+
+    :raises: :exc:`InvalidTransaction` if the signature is invalid
+    """
+    if r >= N or s >= N or v < 27 or v > 28 or r == 0 or s == 0:
+        raise InvalidTransaction("Invalid signature values!")
+    pk = PublicKey(flags=ALL_FLAGS)
+    try:
+        pk.public_key = pk.ecdsa_recover(
+            rawhash,
+            pk.ecdsa_recoverable_deserialize(
+                zpad("".join(chr(c) for c in int_to_32bytearray(r)), 32) + zpad("".join(chr(c) for c in int_to_32bytearray(s)), 32),
+                v - 27
+            ),
+            raw=True
+        )
+        pub = pk.serialize(compressed=False)
+    except Exception:
+        raise InvalidTransaction("Invalid signature values (x^3+7 is non-residue)")
+
+    if pub[1:] == "\x00" * 32:
+        raise InvalidTransaction("Invalid signature (zero privkey cannot sign)")
+    pub = encode_pubkey(pub, 'bin')
+    return utils.sha3(pub[1:])[-20:]
+
+
+def _ecrecover_sender_or_none(args):
+    try:
+        return ecrecover_sender(*args)
+    except InvalidTransaction:
+        return None
+
 
 class Transaction(rlp.Serializable):
 
@@ -52,6 +104,12 @@ class Transaction(rlp.Serializable):
     ]
 
     _sender = None
+    # memoized derived values, reset when a field changes
+    _hash = None
+    _unsigned_hash = None
+    _intrinsic_gas_used = None
+    # set by processblock.prevalidate_transactions
+    _prevalidated = None
 
     def __init__(self, nonce, gasprice, startgas, to, value, data, v=0, r=0, s=0):
         to = utils.normalize_address(to, allow_blank=True)
@@ -67,38 +125,28 @@ class Transaction(rlp.Serializable):
 
         log.debug('deserialized tx', tx=encode_hex(self.hash)[:8])
 
+    def __setattr__(self, attr, value):
+        super(Transaction, self).__setattr__(attr, value)
+        if attr in _field_names:
+            d = self.__dict__
+            d.pop('_hash', None)
+            d.pop('_unsigned_hash', None)
+            d.pop('_intrinsic_gas_used', None)
+            d.pop('_prevalidated', None)
+
     @property
     def sender(self):
 
         if not self._sender:
             # Determine sender
             if self.v:
-                if self.r >= N or self.s >= N or self.v < 27 or self.v > 28 \
-                or self.r == 0 or self.s == 0:
-                    raise InvalidTransaction("Invalid signature values!")
-                log.debug('recovering sender')
-                rlpdata = rlp.encode(self, UnsignedTransaction)
-                rawhash = utils.sha3(rlpdata)
-
-                pk = PublicKey(flags=ALL_FLAGS)
-                try:
-                    pk.public_key = pk.ecdsa_recover(
-                        rawhash,
-                        pk.ecdsa_recoverable_deserialize(
-                            zpad("".join(chr(c) for c in int_to_32bytearray(self.r)), 32) + zpad("".join(chr(c) for c in int_to_32bytearray(self.s)), 32),
-                            self.v - 27
-                        ),
-                        raw=True
-                    )
-                    pub = pk.serialize(compressed=False)
-                except Exception:
-                    raise InvalidTransaction("Invalid signature values (x^3+7 is non-residue)")
-
-                if pub[1:] == "\x00" * 32:
-                    raise InvalidTransaction("Invalid signature (zero privkey cannot sign)")
-                pub = encode_pubkey(pub, 'bin')
-                self._sender = utils.sha3(pub[1:])[-20:]
-                assert self.sender == self._sender
+                txhash = self.hash
+                sender = get_cached_sender(txhash)
+                if sender is None:
+                    log.debug('recovering sender')
+                    sender = ecrecover_sender(self.unsigned_hash, self.v, self.r, self.s)
+                    cache_sender(txhash, sender)
+                self._sender = sender
             else:
                 self._sender = 0
         return self._sender
@@ -114,7 +162,7 @@ class Transaction(rlp.Serializable):
         """
         if key in (0, '', '\x00' * 32, '0' * 64):
             raise InvalidTransaction("Zero privkey cannot sign")
-        rawhash = utils.sha3(rlp.encode(self, UnsignedTransaction))
+        rawhash = self.unsigned_hash
 
         if len(key) == 64:
             # we need a binary key
@@ -130,11 +178,22 @@ class Transaction(rlp.Serializable):
         self.s = big_endian_to_int(signature[32:64])
 
         self.sender = utils.privtoaddr(key)
+        cache_sender(self.hash, self.sender)
         return self
 
     @property
     def hash(self):
-        return utils.sha3(rlp.encode(self))
+        if self._hash is None:
+            self.__dict__['_hash'] = utils.sha3(rlp.encode(self))
+        return self._hash
+
+    @property
+    def unsigned_hash(self):
+        """The hash of the transaction without signature, which is signed."""
+        if self._unsigned_hash is None:
+            self.__dict__['_unsigned_hash'] = \
+                utils.sha3(rlp.encode(self, UnsignedTransaction))
+        return self._unsigned_hash
 
     def log_bloom(self):
         "returns int"
@@ -161,11 +220,14 @@ class Transaction(rlp.Serializable):
 
     @property
     def intrinsic_gas_used(self):
-        num_zero_bytes = str_to_bytes(self.data).count(ascii_chr(0))
-        num_non_zero_bytes = len(self.data) - num_zero_bytes
-        return (opcodes.GTXCOST
+        if self._intrinsic_gas_used is None:
+            num_zero_bytes = str_to_bytes(self.data).count(ascii_chr(0))
+            num_non_zero_bytes = len(self.data) - num_zero_bytes
+            self.__dict__['_intrinsic_gas_used'] = (
+                opcodes.GTXCOST
                 + opcodes.GTXDATAZERO * num_zero_bytes
                 + opcodes.GTXDATANONZERO * num_non_zero_bytes)
+        return self._intrinsic_gas_used
 
     @property
     def creates(self):
@@ -197,9 +259,50 @@ class Transaction(rlp.Serializable):
             raise InvalidTransaction("Invalid signature S value!")
 
 
+_field_names = frozenset(name for name, _ in Transaction.fields)
 UnsignedTransaction = Transaction.exclude(['v', 'r', 's'])
 
 
+# recover_senders uses a pool of worker processes from this many
+# transactions on
+PARALLEL_RECOVERY_MIN_TXS = 64
+
+
+def recover_senders(txs, pool=None):
+    """Recover the senders of many transactions at once.
+
+    Recovered senders are set on the transactions and cached, so that
+    signature recovery does not have to happen during their execution.
+    Transactions with invalid signatures are skipped, accessing their
+    `sender` raises :exc:`InvalidTransaction` as usual.
+
+    :param pool: a `multiprocessing.Pool` owned by the caller to recover
+                 in, if there are at least `PARALLEL_RECOVERY_MIN_TXS`
+                 senders to recover. By default they are recovered in the
+                 calling process.
+    """
+    todo = []
+    for tx in txs:
+        if tx._sender or not tx.v:
+            continue
+        sender = get_cached_sender(tx.hash)
+        if sender is not None:
+            tx._sender = sender
+        else:
+            todo.append(tx)
+    if not todo:
+        return
+    args = [(tx.unsigned_hash, tx.v, tx.r, tx.s) for tx in todo]
+    if pool is not None and len(todo) >= PARALLEL_RECOVERY_MIN_TXS:
+        senders = pool.map(_ecrecover_sender_or_none, args)
+    else:
+        senders = [_ecrecover_sender_or_none(a) for a in args]
+    for tx, sender in zip(todo, senders):
+        if sender is not None:
+            tx._sender = sender
+            cache_sender(tx.hash, sender)
+
+
 def contract(nonce, gasprice, startgas, endowment, code, v=0, r=0, s=0):
     """A contract is a special transaction without the `to` argument."""
     tx = Transaction(nonce, gasprice, startgas, '', endowment, code, v, r, s)
@@ -0,0 +1,129 @@
+import heapq
+from itertools import count
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.txpool')
+
+
+class TransactionPool(object):
+
+    """Pending transactions, indexed by sender and nonce.
+
+    A transaction replaces a pending one with the same sender and nonce only
+    if its gas price is at least `price_bump` percent higher. If the pool
+    grows beyond `max_size` transactions, the cheapest transaction that
+    no other one depends on (the one with the highest nonce of its sender)
+    is dropped.
+
+    :param max_size: maximum number of transactions in the pool
+    :param max_per_sender: maximum number of transactions of one sender
+    :param price_bump: increase of the gas price in percent a replacing
+                       transaction must offer
+    """
+
+    def __init__(self, max_size=4096, max_per_sender=64, price_bump=10):
+        self.max_size = max_size
+        self.max_per_sender = max_per_sender
+        self.price_bump = price_bump
+        self._by_sender = {}  # sender -> {nonce: tx}
+        self._by_hash = {}  # tx hash -> (arrival, tx)
+        self._arrivals = count()
+
+    def __len__(self):
+        return len(self._by_hash)
+
+    def __contains__(self, txhash):
+        return txhash in self._by_hash
+
+    def __iter__(self):
+        return (tx for _, tx in sorted(self._by_hash.values()))
+
+    def get(self, sender, nonce):
+        """Return the pending transaction of `sender` with `nonce` or `None`."""
+        return self._by_sender.get(sender, {}).get(nonce)
+
+    def add(self, tx):
+        """Add a transaction to the pool.
+
+        :returns: `True` if the transaction was added, possibly replacing
+                  one with the same nonce, or `False` if it was rejected
+                  because it is known, underpriced or its sender has too
+                  many pending transactions
+        :raises: :exc:`ethereum.exceptions.InvalidTransaction` if the sender
+                 can not be recovered
+        """
+        if tx.hash in self._by_hash:
+            return False
+        txs = self._by_sender.setdefault(tx.sender, {})
+        old = txs.get(tx.nonce)
+        if old is not None:
+            if tx.gasprice * 100 < old.gasprice * (100 + self.price_bump):
+                log.debug('underpriced replacement', tx=tx, replaced=old)
+                return False
+            del self._by_hash[old.hash]
+        elif len(txs) >= self.max_per_sender:
+            log.debug('too many pending txs of sender', tx=tx)
+            return False
+        txs[tx.nonce] = tx
+        self._by_hash[tx.hash] = (next(self._arrivals), tx)
+        while len(self._by_hash) > self.max_size:
+            self._evict()
+        return tx.hash in self._by_hash
+
+    def _evict(self):
+        lasts = [txs[max(txs)] for txs in self._by_sender.values()]
+        tx = min(lasts, key=lambda tx: (tx.gasprice, -self._by_hash[tx.hash][0]))
+        log.debug('pool full, dropping tx', tx=tx)
+        self.remove(tx)
+
+    def remove(self, tx):
+        """Remove `tx` from the pool if it is pending."""
+        if tx.hash not in self._by_hash:
+            return
+        del self._by_hash[tx.hash]
+        txs = self._by_sender[tx.sender]
+        del txs[tx.nonce]
+        if not txs:
+            del self._by_sender[tx.sender]
+
+    def clear(self):
+        self._by_sender.clear()
+        self._by_hash.clear()
+
+    def prune(self, get_nonce):
+        """Drop the transactions whose nonce has been used already.
+
+        :param get_nonce: function returning the current nonce of a sender
+        """
+        for sender, txs in list(self._by_sender.items()):
+            nonce = get_nonce(sender)
+            for tx in [tx for n, tx in txs.items() if n < nonce]:
+                self.remove(tx)
+
+    def ordered(self, get_nonce):
+        """Iterate over the executable transactions, best gas price first.
+
+        Only transactions with the current nonce of their sender are
+        executable. The next transaction of a sender is considered once the
+        nonce of the sender increased after the previous one was yielded,
+        i.e. if the caller applied it. Transactions of equal gas price are
+        returned in the order they were added.
+
+        :param get_nonce: function returning the current nonce of a sender
+        """
+        heap = []
+
+        def push(sender, nonce):
+            tx = self.get(sender, nonce)
+            if tx is not None:
+                heapq.heappush(heap, (-tx.gasprice, self._by_hash[tx.hash][0], tx))
+
+        for sender in list(self._by_sender):
+            push(sender, get_nonce(sender))
+        while heap:
+            tx = heapq.heappop(heap)[2]
+            if tx.hash not in self._by_hash:
+                continue
+            yield tx
+            if get_nonce(tx.sender) > tx.nonce:
+                push(tx.sender, tx.nonce + 1)
@@ -6,6 +6,7 @@ verify_stack_after_op = False
 import sys
 
 from ethereum import utils
+from ethereum import arith
 from ethereum.abi import is_numeric
 import copy
 from ethereum import opcodes
@@ -13,6 +14,7 @@ import time
 from ethereum.slogging import get_logger
 from rlp.utils import encode_hex, ascii_chr
 from ethereum.utils import to_string
+from ethereum.tracer import LogTracer
 
 log_log = get_logger('eth.vm.log')
 log_vm_exit = get_logger('eth.vm.exit')
@@ -28,6 +30,8 @@ TT255 = 2 ** 255
 
 class CallData(object):
 
+    __slots__ = ('data', 'offset', 'size', 'rlimit')
+
     def __init__(self, parent_memory, offset=0, size=None):
         self.data = parent_memory
         self.offset = offset
@@ -46,15 +50,19 @@ class CallData(object):
         return utils.bytearray_to_int(o + [0] * (32 - len(o)))
 
     def extract_copy(self, mem, memstart, datastart, size):
-        for i in range(size):
-            if datastart + i < self.size:
-                mem[memstart + i] = self.data[self.offset + datastart + i]
-            else:
-                mem[memstart + i] = 0
+        avail = min(size, self.size - datastart) if datastart < self.size else 0
+        if avail > 0:
+            start = self.offset + datastart
+            mem[memstart: memstart + avail] = self.data[start: start + avail]
+        if avail < size:
+            mem[memstart + avail: memstart + size] = [0] * (size - avail)
 
 
 class Message(object):
 
+    __slots__ = ('sender', 'to', 'value', 'gas', 'data', 'depth', 'logs',
+                 'code_address', 'is_create', 'transfers_value')
+
     def __init__(self, sender, to, value, gas, data, depth=0, 
             code_address=None, is_create=False, transfers_value=True):
         self.sender = sender
@@ -72,36 +80,38 @@ class Message(object):
         return '<Message(to:%s...)>' % self.to[:8]
 
 
-class Compustate():
+class Compustate(object):
+
+    __slots__ = ('memory', 'stack', 'pc', 'gas')
 
-    def __init__(self, **kwargs):
+    def __init__(self, gas=0, pc=0):
         self.memory = []
         self.stack = []
-        self.pc = 0
-        self.gas = 0
-        for kw in kwargs:
-            setattr(self, kw, kwargs[kw])
+        self.pc = pc
+        self.gas = gas
 
 
-# Preprocesses code, and determines which locations are in the middle
-# of pushdata and thus invalid
+# Preprocesses code into a list indexed by pc, with `None` at the
+# locations in the middle of pushdata, and a bitmap of the valid jump
+# destinations
 def preprocess_code(code):
     assert isinstance(code, bytes)
     code = memoryview(code).tolist()
-    ops = []
+    ops = [None] * len(code)
+    jumpdests = bytearray(len(code))
     i = 0
     while i < len(code):
-        o = copy.copy(opcodes.opcodes.get(code[i], ['INVALID', 0, 0, 0]) + [code[i], 0])
-        ops.append(o)
-        if o[0][:4] == 'PUSH':
+        o = opcodes.opcodes.get(code[i], ['INVALID', 0, 0, 0]) + [code[i], 0]
+        ops[i] = o
+        if o[0] == 'JUMPDEST':
+            jumpdests[i] = 1
+        elif o[0][:4] == 'PUSH':
             for j in range(int(o[0][4:])):
                 i += 1
                 byte = code[i] if i < len(code) else 0
                 o[-1] = (o[-1] << 8) + byte
-                if i < len(code):
-                    ops.append(['INVALID', 0, 0, 0, byte, 0])
         i += 1
-    return ops
+    return ops, jumpdests
 
 
 def mem_extend(mem, compustate, op, start, sz):
@@ -148,26 +158,25 @@ code_cache = {}
 
 
 def vm_execute(ext, msg, code):
-    # precompute trace flag
+    # precompute tracer
     # if we trace vm, we're in slow mode anyway
-    trace_vm = log_vm_op.is_active('trace')
+    tracer = ext.tracer
+    if tracer is None and log_vm_op.is_active('trace'):
+        tracer = LogTracer(ext)
 
     compustate = Compustate(gas=msg.gas)
     stk = compustate.stack
     mem = compustate.memory
 
     if code in code_cache:
-        processed_code = code_cache[code]
+        processed_code, jumpdests = code_cache[code]
     else:
-        processed_code = preprocess_code(code)
-        code_cache[code] = processed_code
+        processed_code, jumpdests = code_cache[code] = preprocess_code(code)
 
     codelen = len(processed_code)
 
     s = time.time()
     op = None
-    steps = 0
-    _prevop = None  # for trace only
 
     while 1:
         # print 'op: ', op, time.time() - s
@@ -198,41 +207,8 @@ def vm_execute(ext, msg, code):
         compustate.gas -= fee
         compustate.pc += 1
 
-        if trace_vm:
-            """
-            This diverges from normal logging, as we use the logging namespace
-            only to decide which features get logged in 'eth.vm.op'
-            i.e. tracing can not be activated by activating a sub
-            like 'eth.vm.op.stack'
-            """
-            trace_data = {}
-            trace_data['stack'] = list(map(to_string, list(compustate.stack)))
-            if _prevop in ('MLOAD', 'MSTORE', 'MSTORE8', 'SHA3', 'CALL',
-                           'CALLCODE', 'CREATE', 'CALLDATACOPY', 'CODECOPY',
-                           'EXTCODECOPY'):
-                if len(compustate.memory) < 1024:
-                    trace_data['memory'] = \
-                        b''.join([encode_hex(ascii_chr(x)) for x
-                                  in compustate.memory])
-                else:
-                    trace_data['sha3memory'] = \
-                        encode_hex(utils.sha3(''.join([ascii_chr(x) for
-                                              x in compustate.memory])))
-            if _prevop in ('SSTORE', 'SLOAD') or steps == 0:
-                trace_data['storage'] = ext.log_storage(msg.to)
-            trace_data['gas'] = to_string(compustate.gas + fee)
-            trace_data['inst'] = opcode
-            trace_data['pc'] = to_string(compustate.pc - 1)
-            if steps == 0:
-                trace_data['depth'] = msg.depth
-                trace_data['address'] = msg.to
-            trace_data['op'] = op
-            trace_data['steps'] = steps
-            if op[:4] == 'PUSH':
-                trace_data['pushvalue'] = pushval
-            log_vm_op.trace('vm', **trace_data)
-            steps += 1
-            _prevop = op
+        if tracer:
+            tracer.step(msg, compustate, op, pushval, fee)
 
         # Invalid operation
         if op == 'INVALID':
@@ -243,62 +219,44 @@ def vm_execute(ext, msg, code):
             if op == 'STOP':
                 return peaceful_exit('STOP', compustate.gas, [])
             elif op == 'ADD':
-                stk.append((stk.pop() + stk.pop()) & TT256M1)
+                stk.append(arith.add(stk.pop(), stk.pop()))
             elif op == 'SUB':
-                stk.append((stk.pop() - stk.pop()) & TT256M1)
+                stk.append(arith.sub(stk.pop(), stk.pop()))
             elif op == 'MUL':
-                stk.append((stk.pop() * stk.pop()) & TT256M1)
+                stk.append(arith.mul(stk.pop(), stk.pop()))
             elif op == 'DIV':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 // s1)
+                stk.append(arith.div(stk.pop(), stk.pop()))
             elif op == 'MOD':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 % s1)
+                stk.append(arith.mod(stk.pop(), stk.pop()))
             elif op == 'SDIV':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
-                                              (-1 if s0 * s1 < 0 else 1)) & TT256M1)
+                stk.append(arith.sdiv(stk.pop(), stk.pop()))
             elif op == 'SMOD':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
-                                              (-1 if s0 < 0 else 1)) & TT256M1)
+                stk.append(arith.smod(stk.pop(), stk.pop()))
             elif op == 'ADDMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 + s1) % s2 if s2 else 0)
+                stk.append(arith.addmod(stk.pop(), stk.pop(), stk.pop()))
             elif op == 'MULMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 * s1) % s2 if s2 else 0)
+                stk.append(arith.mulmod(stk.pop(), stk.pop(), stk.pop()))
             elif op == 'EXP':
                 base, exponent = stk.pop(), stk.pop()
                 # fee for exponent is dependent on its bytes
-                # calc n bytes to represent exponent
-                nbytes = len(utils.encode_int(exponent))
-                expfee = nbytes * opcodes.GEXPONENTBYTE
+                expfee = arith.exp_bytes(exponent) * opcodes.GEXPONENTBYTE
                 if compustate.gas < expfee:
                     compustate.gas = 0
                     return vm_exception('OOG EXPONENT')
                 compustate.gas -= expfee
-                stk.append(pow(base, exponent, TT256))
+                stk.append(arith.exp(base, exponent))
             elif op == 'SIGNEXTEND':
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 <= 31:
-                    testbit = s0 * 8 + 7
-                    if s1 & (1 << testbit):
-                        stk.append(s1 | (TT256 - (1 << testbit)))
-                    else:
-                        stk.append(s1 & ((1 << testbit) - 1))
-                else:
-                    stk.append(s1)
+                stk.append(arith.signextend(stk.pop(), stk.pop()))
         elif opcode < 0x20:
             if op == 'LT':
                 stk.append(1 if stk.pop() < stk.pop() else 0)
             elif op == 'GT':
                 stk.append(1 if stk.pop() > stk.pop() else 0)
             elif op == 'SLT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+                s0, s1 = arith.to_signed(stk.pop()), arith.to_signed(stk.pop())
                 stk.append(1 if s0 < s1 else 0)
             elif op == 'SGT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+                s0, s1 = arith.to_signed(stk.pop()), arith.to_signed(stk.pop())
                 stk.append(1 if s0 > s1 else 0)
             elif op == 'EQ':
                 stk.append(1 if stk.pop() == stk.pop() else 0)
@@ -351,7 +309,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG COPY DATA')
                 msg.data.extract_copy(mem, mstart, dstart, size)
             elif op == 'CODESIZE':
-                stk.append(len(processed_code))
+                stk.append(codelen)
             elif op == 'CODECOPY':
                 start, s1, size = stk.pop(), stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, start, size):
@@ -359,8 +317,8 @@ def vm_execute(ext, msg, code):
                 if not data_copy(compustate, size):
                     return vm_exception('OOG COPY DATA')
                 for i in range(size):
-                    if s1 + i < len(processed_code):
-                        mem[start + i] = processed_code[s1 + i][4]
+                    if s1 + i < codelen:
+                        mem[start + i] = utils.safe_ord(code[s1 + i])
                     else:
                         mem[start + i] = 0
             elif op == 'GASPRICE':
@@ -418,7 +376,10 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 mem[s0] = s1 % 256
             elif op == 'SLOAD':
-                stk.append(ext.get_storage_data(msg.to, stk.pop()))
+                s0 = stk.pop()
+                stk.append(ext.get_storage_data(msg.to, s0))
+                if tracer:
+                    tracer.storage(msg, s0, stk[-1], False)
             elif op == 'SSTORE':
                 s0, s1 = stk.pop(), stk.pop()
                 if ext.get_storage_data(msg.to, s0):
@@ -432,19 +393,17 @@ def vm_execute(ext, msg, code):
                 compustate.gas -= gascost
                 ext.add_refund(refund)  # adds neg gascost as a refund if below zero
                 ext.set_storage_data(msg.to, s0, s1)
+                if tracer:
+                    tracer.storage(msg, s0, s1, True)
             elif op == 'JUMP':
                 compustate.pc = stk.pop()
-                opnew = processed_code[compustate.pc][0] if \
-                    compustate.pc < len(processed_code) else 'STOP'
-                if opnew != 'JUMPDEST':
+                if compustate.pc >= codelen or not jumpdests[compustate.pc]:
                     return vm_exception('BAD JUMPDEST')
             elif op == 'JUMPI':
                 s0, s1 = stk.pop(), stk.pop()
                 if s1:
                     compustate.pc = s0
-                    opnew = processed_code[compustate.pc][0] if \
-                        compustate.pc < len(processed_code) else 'STOP'
-                    if opnew != 'JUMPDEST':
+                    if s0 >= codelen or not jumpdests[s0]:
                         return vm_exception('BAD JUMPDEST')
             elif op == 'PC':
                 stk.append(compustate.pc - 1)
@@ -529,8 +488,8 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    outsz = min(len(data), memoutsz)
+                    mem[memoutstart: memoutstart + outsz] = data[:outsz]
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
@@ -568,8 +527,8 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    outsz = min(len(data), memoutsz)
+                    mem[memoutstart: memoutstart + outsz] = data[:outsz]
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
@@ -603,6 +562,7 @@ class VmExtBase():
         self.set_storage_data = lambda addr, key, value: 0
         self.get_storage_data = lambda addr, key: 0
         self.log_storage = lambda addr: 0
+        self.tracer = None
         self.add_suicide = lambda addr: 0
         self.add_refund = lambda x: 0
         self.block_prevhash = 0